@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+# Measures the memory that the items of a loaded store take, as dicts and
+# as CompactItems, with tracemalloc.
+
+import argparse
+import gc
+import json
+import pathlib
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from clikb.kanban_directory_store import KanbanDirectoryStore
+
+from generate_store import generate_store
+
+def measure(path, compact):
+    gc.collect()
+    tracemalloc.start()
+    k = KanbanDirectoryStore()
+    k.load(path)
+    k.compact_items = compact
+    start = time.perf_counter()
+    items = [ k._from_disk(item) for item in k.items() ]
+    elapsed = time.perf_counter() - start
+    # only what the items keep alive counts, not the parsing
+    del k
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, elapsed, items
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, nargs='+', default=[ 1000, 10000 ])
+    parser.add_argument('--history', type=int, default=3, help="status changes per item")
+    parser.add_argument('-o', '--output', type=pathlib.Path, help="write the results as JSON")
+    args = parser.parse_args()
+    results = []
+    print('%8s %12s %12s %7s %12s' % ('items', 'dict', 'compact', 'ratio', 'convert'), file=sys.stderr)
+    for num_items in args.items:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / 'store'
+            generate_store(path, num_items, history=args.history)
+            dict_size, elapsed, items = measure(path, False)
+            del items
+            compact_size, elapsed, items = measure(path, True)
+            del items
+        results.append({ 'items': num_items, 'dict_bytes': dict_size, 'compact_bytes': compact_size,
+                'convert_seconds': elapsed })
+        print('%8d %10.1fMB %10.1fMB %6.2fx %10.1fms' % (num_items, dict_size / 1e6, compact_size / 1e6,
+                dict_size / compact_size, elapsed * 1000), file=sys.stderr)
+    if args.output:
+        with args.output.open('w') as f:
+            json.dump(results, f, indent=1)
+
+if __name__ == "__main__":
+    main()
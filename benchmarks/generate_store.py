@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+# Generates a synthetic kanban store for the benchmarks, with the plugins
+# and fields of a typical board.
+
+import argparse
+import datetime
+import pathlib
+import random
+
+from clikb.cli import kanban_stores
+
+STATUSES = [ 'READY', 'DOING', 'DONE' ]
+DATE_FORMAT = '%Y-%m-%d'
+
+def make_board(statuses):
+    return {
+        'date_format': DATE_FORMAT,
+        'default_fields': { 'description': 'hello', 'status': statuses[0] },
+        'plugin_conf': [
+            { 'due': { 'due_text': { 'text': '%(due_days)s days' } } },
+            { 'tag_icons': { 'tag0': 'B', 'tag1': 'F' } },
+        ],
+        'plugins': [ 'due', 'tag_icons', 'status_change' ],
+        'show_field_format': {
+            'console': { 'default': [
+                { 'text': '%(id)3d %(description)s' },
+                { 'text': '    %(due_icon)s%(due_text)s %(tags)s' } ] },
+            'csv': { 'default': '%(id)3d %(description)s' },
+        },
+        'show_statuses': statuses,
+    }
+
+def make_item(rnd, i, statuses, tags, due_fraction, history, today, store=None):
+    item = {
+        'description': 'synthetic item %d %s' % (i, 'x' * rnd.randrange(40)),
+        'status': rnd.choice(statuses),
+        'tags': rnd.sample(tags, rnd.randrange(min(3, len(tags)) + 1)),
+    }
+    if rnd.random() < due_fraction:
+        due = today + datetime.timedelta(days=rnd.randrange(-30, 60))
+        item['due'] = due.strftime(DATE_FORMAT)
+    changed = datetime.datetime.combine(today, datetime.time()) - datetime.timedelta(days=rnd.randrange(365))
+    status_changes = []
+    for status in [ rnd.choice(statuses) for n in range(history - 1) ] + [ item['status'] ]:
+        changed += datetime.timedelta(hours=rnd.randrange(1, 24 * 14))
+        status_changes.append({ 'status': status, 'date': changed })
+    if store is not None:
+        for change in status_changes:
+            store.log_status_change(item, change['status'], change['date'])
+    elif status_changes:
+        item['_status_changes'] = status_changes
+    return item
+
+def generate_store(path, num_items, statuses=STATUSES, num_tags=8, due_fraction=0.3, history=3,
+        backend='directory', seed=0, event_log=False):
+    rnd = random.Random(seed)
+    tags = [ 'tag%d' % n for n in range(num_tags) ]
+    today = datetime.date.today()
+    store = kanban_stores[backend]()
+    store.board = make_board(statuses)
+    if backend != 'directory':
+        store.board['store_backend'] = backend
+    for i in range(num_items):
+        store.add_item(make_item(rnd, i, statuses, tags, due_fraction, history, today,
+                store if event_log else None))
+    store.fsync = False
+    store.save(pathlib.Path(path))
+    return store
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', type=pathlib.Path)
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--statuses', nargs='+', default=STATUSES)
+    parser.add_argument('--tags', type=int, default=8)
+    parser.add_argument('--due-fraction', type=float, default=0.3)
+    parser.add_argument('--history', type=int, default=3, help="status changes per item")
+    parser.add_argument('--event-log', action='store_true', help="write the history to the event log")
+    parser.add_argument('--backend', choices=kanban_stores.keys(), default='directory')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if (args.path / 'board.kbb').exists():
+        parser.error("%s already contains a store" % args.path)
+    generate_store(args.path, args.items, args.statuses, args.tags, args.due_fraction, args.history,
+            args.backend, args.seed, args.event_log)
+
+if __name__ == "__main__":
+    main()
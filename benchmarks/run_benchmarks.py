@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+
+# Runs the benchmarks on synthetic stores of several sizes and saves the
+# timings as JSON, so that they can be compared between commits.
+#
+# Every benchmark does its setup and returns the function that is timed.
+
+import argparse
+import datetime
+import io
+import json
+import pathlib
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+from click.testing import CliRunner
+
+from clikb import cli
+from clikb.kanban_directory_store import KanbanDirectoryStore
+from clikb.kanban_packed_store import KanbanPackedStore
+from clikb.kanban_board_renderer import KanbanBoardConsoleRenderer, KanbanBoardCSVRenderer, KanbanBoardJSONLRenderer
+from clikb.kanban_item_editor import KanbanItemEditor
+from clikb.kanban_query import KanbanQuery
+from clikb.kanban_stats import KanbanFlowStats
+from clikb.base_kanban_store import KanbanEventLog
+
+from generate_store import generate_store, STATUSES
+
+PLUGIN_PATH = str(pathlib.Path(__file__).resolve().parent.parent / 'kanban_plugins')
+
+benchmarks = []
+
+def benchmark(name):
+    def register(func):
+        benchmarks.append((name, func))
+        return func
+    return register
+
+
+class Environment:
+
+    def __init__(self, tmpdir, num_items):
+        self.num_items = num_items
+        self.path = pathlib.Path(tmpdir) / 'directory'
+        self.packed_path = pathlib.Path(tmpdir) / 'packed'
+        generate_store(self.path, num_items)
+        generate_store(self.packed_path, num_items, backend='packed')
+
+    def copy(self, name, path=None):
+        # a store that a benchmark can change
+        dest = self.path.parent / name
+        shutil.rmtree(dest, ignore_errors=True)
+        shutil.copytree(path or self.path, dest)
+        return dest
+
+    def make_app(self, path=None):
+        ctx = click.Context(cli.app)
+        ctx.params = { 'kanban_store': str(path or self.path), 'kanban_plugin_path': PLUGIN_PATH,
+                'store_backend': None, 'parallel_load': None, 'verbose': False }
+        kanban_app = cli.KanbanApp(ctx)
+        kanban_app.initialize()
+        return kanban_app
+
+    def invoke(self, args, path=None):
+        result = CliRunner().invoke(cli.app, [ '-d', str(path or self.path), '-P', PLUGIN_PATH ] + args)
+        if result.exit_code != 0:
+            raise RuntimeError("%s failed: %s" % (' '.join(args), result.output))
+        return result
+
+
+@benchmark('store.load')
+def bench_load(env):
+    return lambda: KanbanDirectoryStore().load(env.path)
+
+@benchmark('store.load_cached')
+def bench_load_cached(env):
+    KanbanDirectoryStore(cache=True).load(env.path)
+    return lambda: KanbanDirectoryStore(cache=True).load(env.path)
+
+@benchmark('store.load_lazy')
+def bench_load_lazy(env):
+    return lambda: KanbanDirectoryStore(lazy=True).load(env.path)
+
+@benchmark('store.load_compact')
+def bench_load_compact(env):
+    def run():
+        k = KanbanDirectoryStore(lazy=True)
+        k.load(env.path)
+        k.compact_items = True
+        k.items()
+    return run
+
+@benchmark('store.load_packed')
+def bench_load_packed(env):
+    return lambda: KanbanPackedStore().load(env.packed_path)
+
+def bench_save(env, fsync, full):
+    path = env.copy('save')
+    k = KanbanDirectoryStore()
+    k.load(path)
+    k.fsync = fsync
+    dest = path.parent / 'save_full'
+    def run():
+        if full:
+            shutil.rmtree(dest, ignore_errors=True)
+            k.save(dest)
+        else:
+            k.edit_item(env.num_items // 2, { 'status': 'DONE' })
+            k.save()
+    return run
+
+@benchmark('store.save_full')
+def bench_save_full(env):
+    return bench_save(env, False, True)
+
+@benchmark('store.save_full_fsync')
+def bench_save_full_fsync(env):
+    return bench_save(env, True, True)
+
+@benchmark('store.save_single')
+def bench_save_single(env):
+    return bench_save(env, False, False)
+
+@benchmark('store.save_single_fsync')
+def bench_save_single_fsync(env):
+    return bench_save(env, True, False)
+
+@benchmark('store.save_packed_single')
+def bench_save_packed_single(env):
+    k = KanbanPackedStore()
+    k.load(env.copy('save_packed', env.packed_path))
+    k.fsync = False
+    def run():
+        k.edit_item(env.num_items // 2, { 'status': 'DONE' })
+        k.save()
+    return run
+
+@benchmark('query.select')
+def bench_query(env):
+    k = KanbanDirectoryStore()
+    k.load(env.path)
+    query = KanbanQuery.parse('status=DOING tags~=tag1')
+    return lambda: query.select(k)
+
+@benchmark('plugins.load')
+def bench_plugins(env):
+    kanban_app = env.make_app()
+    return kanban_app._load_plugins
+
+@benchmark('render.group_by_status')
+def bench_group_by_status(env):
+    kanban_app = env.make_app()
+    kanban_app.kanban_store.items()
+    renderer = KanbanBoardCSVRenderer(kanban_app, '', io.StringIO())
+    return lambda: [ row for row in renderer.group_by_status() ]
+
+def bench_renderer(env, renderer_class, out_format):
+    kanban_app = env.make_app()
+    kanban_app.kanban_store.items()
+    field_fmt = kanban_app.kanban_store.get_board()['show_field_format'][out_format]['default']
+    return lambda: kanban_app.run_hooks('show', renderer_class(kanban_app, field_fmt, io.StringIO()))
+
+@benchmark('render.console')
+def bench_render_console(env):
+    return bench_renderer(env, KanbanBoardConsoleRenderer, 'console')
+
+@benchmark('render.csv')
+def bench_render_csv(env):
+    return bench_renderer(env, KanbanBoardCSVRenderer, 'csv')
+
+@benchmark('render.jsonl')
+def bench_render_jsonl(env):
+    kanban_app = env.make_app()
+    kanban_app.kanban_store.items()
+    return lambda: kanban_app.run_hooks('show', KanbanBoardJSONLRenderer(kanban_app, None, io.StringIO()))
+
+@benchmark('render.jsonl_fields')
+def bench_render_jsonl_fields(env):
+    # the fields of the CSV format
+    kanban_app = env.make_app()
+    kanban_app.kanban_store.items()
+    keys = [ 'id', 'description' ]
+    return lambda: kanban_app.run_hooks('show', KanbanBoardJSONLRenderer(kanban_app, keys, io.StringIO()))
+
+@benchmark('editor.template')
+def bench_editor_template(env):
+    kanban_app = env.make_app()
+    items = kanban_app.kanban_store.items()[:1000]
+    def run():
+        for item in items:
+            editor = KanbanItemEditor(kanban_app, item['id'], {})
+            kanban_app.dispatch('edit', 'pre', editor)
+            editor._create_editor_template(item)
+    return run
+
+def bench_stats(env, cached, new_event=False):
+    path = env.path.parent / 'stats'
+    if not path.exists():
+        generate_store(path, env.num_items, event_log=True)
+    flow = KanbanFlowStats(path)
+    flow.update()
+    flow.report(STATUSES, 'DOING', 'DONE')
+    flow.save()
+    statuses = iter(STATUSES * 1000)
+    def run():
+        if new_event:
+            KanbanEventLog(path).append([ { 'id': env.num_items // 2, 'status': next(statuses),
+                'date': datetime.datetime.now() } ], fsync=False)
+        flow = KanbanFlowStats(path)
+        if cached:
+            flow.load()
+        flow.update()
+        flow.report(STATUSES, 'DOING', 'DONE')
+        if new_event:
+            flow.save()
+    return run
+
+@benchmark('stats.report')
+def bench_stats_report(env):
+    return bench_stats(env, False)
+
+@benchmark('stats.report_cached')
+def bench_stats_report_cached(env):
+    return bench_stats(env, True)
+
+@benchmark('stats.report_new_event')
+def bench_stats_report_new_event(env):
+    return bench_stats(env, True, True)
+
+@benchmark('cli.show')
+def bench_cli_show(env):
+    return lambda: env.invoke([ 'show' ])
+
+@benchmark('cli.show_query')
+def bench_cli_show_query(env):
+    return lambda: env.invoke([ 'show', '-q', 'tags~=tag1' ])
+
+@benchmark('cli.list')
+def bench_cli_list(env):
+    return lambda: env.invoke([ 'list' ])
+
+@benchmark('cli.list_jsonl')
+def bench_cli_list_jsonl(env):
+    return lambda: env.invoke([ 'list', '--out-format', 'jsonl' ])
+
+@benchmark('cli.edit')
+def bench_cli_edit(env):
+    path = env.copy('edit')
+    statuses = iter([ 'DOING', 'DONE' ] * 1000)
+    return lambda: env.invoke([ 'edit', str(env.num_items // 2), 'status=%s' % next(statuses) ], path)
+
+
+def run_benchmarks(sizes, repeat, selected):
+    results = []
+    for num_items in sizes:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            env = Environment(tmpdir, num_items)
+            for name, func in benchmarks:
+                if selected and not any(s in name for s in selected):
+                    continue
+                run = func(env)
+                times = []
+                for i in range(repeat):
+                    start = time.perf_counter()
+                    run()
+                    times.append(time.perf_counter() - start)
+                result = { 'name': name, 'items': num_items, 'times': times,
+                        'min': min(times), 'median': statistics.median(times) }
+                print_result(result)
+                results.append(result)
+    return results
+
+def print_result(result, baseline=None):
+    line = '%-28s %8d %10.2fms %10.2fms' % (result['name'], result['items'],
+            result['min'] * 1000, result['median'] * 1000)
+    if baseline is not None:
+        line += ' %+7.1f%%' % ((result['median'] / baseline['median'] - 1) * 100)
+    print(line, file=sys.stderr)
+
+def git_commit():
+    try:
+        return subprocess.run([ 'git', 'rev-parse', 'HEAD' ], capture_output=True, text=True,
+                cwd=pathlib.Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_file):
+    with open(baseline_file) as f:
+        baseline = { (r['name'], r['items']): r for r in json.load(f)['results'] }
+    print('\ncompared to %s (median):' % baseline_file, file=sys.stderr)
+    for result in results:
+        print_result(result, baseline.get((result['name'], result['items'])))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, nargs='+', default=[ 1000, 10000 ])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('-o', '--output', type=pathlib.Path, help="write the results as JSON")
+    parser.add_argument('--compare', type=pathlib.Path, help="JSON results of an earlier run")
+    parser.add_argument('benchmarks', nargs='*', help="only run benchmarks whose name contains one of these")
+    args = parser.parse_args()
+    print('%-28s %8s %12s %12s' % ('benchmark', 'items', 'min', 'median'), file=sys.stderr)
+    results = run_benchmarks(args.items, args.repeat, args.benchmarks)
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        with args.output.open('w') as f:
+            json.dump({
+                'commit': git_commit(),
+                'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'results': results,
+            }, f, indent=1)
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,37 @@
 import datetime
 from clikb.base_kanban_plugin import BaseKanbanPlugin
+from clikb.kanban_board_renderer import RenderItem
 
 class KanbanPlugin(BaseKanbanPlugin):
 
-    def due_delta(self, item):
-        today = datetime.date.today()
+    def __init__(self, kanban_app):
+        BaseKanbanPlugin.__init__(self, kanban_app)
+        self.date_format = None
+        # due date strings parsed with date_format
+        self._parsed_dates = {}
+
+    def parse_due(self, due):
+        if type(due) == datetime.datetime:
+            return due.date()
+        if type(due) == datetime.date:
+            return due
+        try:
+            return self._parsed_dates[due]
+        except KeyError:
+            pass
+        try:
+            parsed = datetime.datetime.strptime(due, self.date_format).date()
+        except ValueError:
+            parsed = None
+        self._parsed_dates[due] = parsed
+        return parsed
+
+    def due_delta(self, item, today=None):
+        if today is None:
+            today = datetime.date.today()
         due = item.get('due')
         if due:
-            if type(due) != datetime.date and type(due) != datetime.datetime:
-                date_format = self.kanban_store.get_board().get('date_format', '%Y-%m-%d')
-                try:
-                    due = datetime.datetime.strptime(due, date_format)
-                except ValueError:
-                    due = today
-            if type(due) == datetime.datetime:
-                due = due.date()
+            due = self.parse_due(due) or today
             delta = due - today
             return delta
         return None
@@ -27,8 +44,7 @@ class KanbanPlugin(BaseKanbanPlugin):
 
     def due_text(self, item):
         if item.get('due_days') is not None:
-            text_fmt = self.kanban_store.get_plugin_conf('due').get('due_text', {}).get('text', '')
-            return text_fmt % item
+            return self.due_text_format % item
         return ''
 
     def due_icon(self, item):
@@ -43,10 +59,27 @@ class KanbanPlugin(BaseKanbanPlugin):
         return ''
         # 💣 💥  📅 🔔 🔥 🕑 🕚 🕰 🗓 ⌚ ⌛ ⏰ ⏱ ⏲ ⏳
 
+    def due_columns(self, items):
+        today = datetime.date.today()
+        no_due = (None, '', '')
+        values = []
+        for item in items:
+            if not item.get('due'):
+                values.append(no_due)
+                continue
+            d = RenderItem(item)
+            d['due_days'] = self.due_delta(d, today).days
+            d['due_text'] = self.due_text(d)
+            values.append((d['due_days'], d['due_text'], self.due_icon(d)))
+        return values
+
     def show_pre(self, renderer):
-        renderer.add_computed_field("due_days", self.due_days)
-        renderer.add_computed_field("due_text", self.due_text)
-        renderer.add_computed_field("due_icon", self.due_icon)
+        date_format = self.kanban_store.get_board().get('date_format', '%Y-%m-%d')
+        if date_format != self.date_format:
+            self._parsed_dates = {}
+        self.date_format = date_format
+        self.due_text_format = self.kanban_store.get_plugin_conf('due').get('due_text', {}).get('text', '')
+        renderer.add_computed_columns(["due_days", "due_text", "due_icon"], self.due_columns)
 
     def set_default_fields(self, editor):
         defaults = self.kanban_store.get_board().get('default_fields', {})
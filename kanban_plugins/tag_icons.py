@@ -5,13 +5,14 @@ from clikb.base_kanban_plugin import BaseKanbanPlugin
 class KanbanPlugin(BaseKanbanPlugin):
 
     def tags_icons(self, item):
-        tag_icons = self.kanban_store.get_plugin_conf('tag_icons')
         tags = item.get('tags',[])
-        tags = [ tag_icons.get(t, t) for t in tags ]
+        tags = [ self.tag_icons.get(t, t) for t in tags ]
         return " ".join(tags)
 
     def show_pre(self, renderer):
-        renderer.add_computed_field("tags", self.tags_icons)
+        self.tag_icons = self.kanban_store.get_plugin_conf('tag_icons')
+        renderer.add_computed_field("tags", self.tags_icons,
+                depends=['tags'], context=self.tag_icons)
 
     def set_default_fields(self, editor):
         defaults = self.kanban_store.get_board().get('default_fields', {})
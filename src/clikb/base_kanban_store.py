@@ -0,0 +1,653 @@
+import contextlib
+import copy
+import datetime
+import json
+import os
+import pathlib
+import pickle
+import re
+import tempfile
+import yaml
+from .kanban_item import CompactItem
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+BOARD_FILE = "board.kbb"
+LOCK_FILE = ".kblock"
+EVENT_LOG_FILE = "events.kbl"
+# number of temporary files that are written before they are synced
+FSYNC_BATCH_SIZE = 128
+# keys with a secondary index for queries
+INDEXED_KEYS = ('status', 'tags')
+# the only classes that a cache file may contain, besides the builtin types
+CACHE_CLASSES = set( ('datetime', name) for name in ('date', 'datetime', 'time', 'timedelta', 'timezone') )
+# the formats of the dates that isoformat() writes, and its UTC offset
+ISO_DATE_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')
+ISO_OFFSET_RE = re.compile(r'(.*)([+-])(\d\d):(\d\d)$')
+
+def index_entry(item):
+    # per indexed key the values as strings and whether the item has a list
+    # of values. Queries can only look up the values of lists, or compare
+    # whole values.
+    entry = []
+    for key in INDEXED_KEYS:
+        v = item.get(key)
+        if v is None:
+            entry.append(((), True))
+        elif isinstance(v, list):
+            entry.append((tuple(str(x) for x in v), True))
+        else:
+            entry.append(((str(v),), False))
+    return tuple(entry)
+
+def load_board(path):
+    with (pathlib.Path(path) / BOARD_FILE).open("r") as f:
+        d = yaml.safe_load(f)
+        return d
+
+
+class KanbanStoreConflict(Exception):
+    pass
+
+
+def file_version(fn):
+    try:
+        st = os.stat(fn)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_ctime_ns, st.st_size, st.st_ino)
+
+
+@contextlib.contextmanager
+def store_lock(path):
+    # held by writers while they save, readers do not lock
+    if fcntl is None:
+        yield
+        return
+    with (pathlib.Path(path) / LOCK_FILE).open("a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def fsync_directory(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        # not possible on all platforms
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_files_atomically(files, fsync=True):
+    # files is a list of (path, text). Each text is written to a temporary
+    # file next to its path. The temporary files are synced in batches and
+    # renamed over their paths only after all of them are written, so a
+    # crash leaves either the old or the new version of every file.
+    written = []
+    try:
+        for start in range(0, len(files), FSYNC_BATCH_SIZE):
+            batch = []
+            try:
+                for fn, text in files[start:start+FSYNC_BATCH_SIZE]:
+                    tmp_fn = fn.with_name('.' + fn.name + '.tmp')
+                    f = tmp_fn.open("w")
+                    batch.append(f)
+                    written.append((tmp_fn, fn))
+                    f.write(text)
+                if fsync:
+                    for f in batch:
+                        f.flush()
+                        os.fsync(f.fileno())
+            finally:
+                for f in batch:
+                    f.close()
+    except BaseException:
+        for tmp_fn, fn in written:
+            try:
+                tmp_fn.unlink()
+            except OSError:
+                pass
+        raise
+    for tmp_fn, fn in written:
+        os.replace(tmp_fn, fn)
+    if fsync:
+        for directory in set( fn.parent for fn, text in files ):
+            fsync_directory(directory)
+
+
+class CacheUnpickler(pickle.Unpickler):
+    # cache files are in the store, which can come from anywhere, e.g. a
+    # git checkout. They may contain data only, never code to run.
+
+    def find_class(self, module, name):
+        if (module, name) not in CACHE_CLASSES:
+            raise pickle.UnpicklingError("%s.%s is not allowed in a cache" % (module, name))
+        return pickle.Unpickler.find_class(self, module, name)
+
+
+def read_cache_file(fn):
+    # raises an exception for a missing, damaged or unsafe cache
+    with open(fn, "rb") as f:
+        return CacheUnpickler(f).load()
+
+def new_file_mode():
+    # the mode open() gives new files
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+def write_cache_file(fn, data):
+    # written to a unique temporary file, since readers that do not lock
+    # can write the same cache at the same time
+    fn = pathlib.Path(fn)
+    fd, tmp_fn = tempfile.mkstemp(prefix='.' + fn.name + '.', suffix='.tmp', dir=fn.parent)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            # mkstemp makes the file private, the other users of a shared
+            # store read the cache too
+            if hasattr(os, 'fchmod'):
+                os.fchmod(f.fileno(), new_file_mode())
+        os.replace(tmp_fn, fn)
+    except BaseException:
+        try:
+            os.unlink(tmp_fn)
+        except OSError:
+            pass
+        raise
+
+
+def parse_isoformat(value):
+    # datetime.fromisoformat is new in Python 3.7, this reads what the event
+    # log writes without it
+    tz = None
+    m = ISO_OFFSET_RE.match(value)
+    if m:
+        value, sign, hours, minutes = m.groups()
+        offset = datetime.timedelta(hours=int(hours), minutes=int(minutes))
+        tz = datetime.timezone(-offset if sign == '-' else offset)
+    for fmt in ISO_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt).replace(tzinfo=tz)
+        except ValueError:
+            pass
+    raise ValueError("invalid date: %s" % value)
+
+try:
+    fromisoformat = datetime.datetime.fromisoformat
+except AttributeError:
+    fromisoformat = parse_isoformat
+
+def parse_event_date(value):
+    try:
+        return fromisoformat(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class KanbanEventLog:
+    # the status changes of the items, one JSON record per line. The log is
+    # only appended to.
+
+    def __init__(self, path):
+        self.fn = pathlib.Path(path) / EVENT_LOG_FILE
+
+    def append(self, events, fsync=True):
+        data = ''.join( json.dumps({ 'id': e['id'], 'status': e['status'],
+            'date': e['date'].isoformat() if isinstance(e['date'], datetime.date) else e['date'] }) + '\n'
+            for e in events ).encode('utf-8')
+        new = not self.fn.exists()
+        with self.fn.open("a+b") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    # end the line of a torn append
+                    data = b'\n' + data
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        if fsync and new:
+            fsync_directory(self.fn.parent)
+
+    def events(self, item_id=None, start=None, end=None):
+        # the events of one or all items in the order they were logged, with
+        # start <= date < end. Dates are datetimes.
+        try:
+            f = self.fn.open("rb")
+        except FileNotFoundError:
+            return []
+        events = []
+        with f:
+            for line in f:
+                try:
+                    e = json.loads(line)
+                except ValueError:
+                    # a torn append
+                    continue
+                if item_id is not None and e['id'] != item_id:
+                    continue
+                e['date'] = parse_event_date(e['date'])
+                if start is not None or end is not None:
+                    if not isinstance(e['date'], datetime.datetime):
+                        continue
+                    if start is not None and e['date'] < start:
+                        continue
+                    if end is not None and e['date'] >= end:
+                        continue
+                events.append(e)
+        return events
+
+
+class BaseKanbanStore:
+
+    def __init__(self, lazy=False):
+        # in lazy mode only the ids are read on load, and an item is parsed
+        # when it is first accessed. Unparsed items are stored as None.
+        self.lazy = lazy
+        self._items = {}
+        # items() in id order and the position of each id in it, built
+        # when needed and kept up to date by add_item and set_item
+        self._item_list = None
+        self._positions = {}
+        self.kbstore_path = None
+        self.max_idx = -1
+        self.board = {}
+        self._dirty = set()
+        self._saved_board = None
+        self._all_parsed = True
+        # sync written files to disk, can be turned off in board.kbb
+        self.fsync = True
+        # keep items read from disk as CompactItems, set in board.kbb
+        self.compact_items = False
+        self._save_deferred = False
+        # per indexed key: value -> ids, and the ids with a single value
+        self._postings = None
+        # the version of each item as it was read from disk, to detect
+        # changes by other writers. Stores fill these in when reading.
+        self._versions = {}
+        self._board_version = None
+        self._added = set()
+        # ids of items to remove from the store on the next save
+        self._removed = set()
+        # (item, status, date) to append to the event log on the next save
+        self._events = []
+
+    def load(self, path):
+        self._versions = {}
+        self._board_version = file_version(pathlib.Path(path) / BOARD_FILE)
+        # read first, stores may be configured in it
+        self.board = load_board(path)
+        self.compact_items = self.board.get('compact_items', False)
+        if self.lazy:
+            self._items = dict.fromkeys(self._list_item_ids(path))
+            self._all_parsed = self._items == {}
+        else:
+            self._items = { i['id']: self._from_disk(i) for i in self._load_items(path) }
+            self._all_parsed = True
+        self._item_list = None
+        self._postings = None
+        # ids of archived items are not given out again
+        self.max_idx = max(max(self._items, default=-1), self.board.get('max_archived_id', -1))
+        self.fsync = self.board.get('fsync', True)
+        self.kbstore_path = path
+        self._dirty = set()
+        self._added = set()
+        self._removed = set()
+        self._events = []
+        self._saved_board = copy.deepcopy(self.board)
+
+    @contextlib.contextmanager
+    def deferred_save(self):
+        # saves to the store's own path are skipped within this context, so
+        # that many edits can be written with a single save afterwards
+        self._save_deferred = True
+        try:
+            yield self
+        finally:
+            self._save_deferred = False
+
+    def save(self, path=None):
+        if self._save_deferred and (not path or path == self.kbstore_path):
+            return 0
+        if not path:
+            if self.kbstore_path is not None:
+                path = self.kbstore_path
+            else:
+                raise Exception("No kbstore path")
+
+        # if self.kbstore_path is None: self.kbstore_path = path
+
+        self._create_kbstore_directory(path)
+
+        # a store saved somewhere else than where it was loaded from is
+        # written completely, otherwise only the changed items are written
+        incremental = path == self.kbstore_path
+        with store_lock(path):
+            if incremental:
+                self._check_conflicts(path)
+                items = [ self._items[i] for i in sorted(self._dirty) ]
+            else:
+                items = self.items()
+
+            # before the items, a crash must not lose history
+            self._write_events(path)
+
+            written = self._save_items(path, items, incremental)
+            if incremental and self._removed:
+                self._remove_items(path, sorted(self._removed))
+
+            if not incremental or self.board != self._saved_board:
+                self._save_board(path)
+                written += 1
+                if incremental:
+                    self._board_version = file_version(pathlib.Path(path) / BOARD_FILE)
+
+        if incremental:
+            self._dirty = set()
+            self._added = set()
+            self._removed = set()
+            self._saved_board = copy.deepcopy(self.board)
+        return written
+
+    def _check_conflicts(self, path):
+        # changed items must not have been changed on disk since they were
+        # read. Added items whose id was taken by another writer get a new id.
+        current = self._current_versions(path, self._dirty | self._removed)
+        conflicts = [ str(idx) for idx in sorted((self._dirty - self._added) | self._removed)
+                if idx in self._versions and current.get(idx) != self._versions[idx] ]
+        if self.board != self._saved_board and \
+                file_version(pathlib.Path(path) / BOARD_FILE) != self._board_version:
+            conflicts.append(BOARD_FILE)
+        if conflicts:
+            raise KanbanStoreConflict("Changed by someone else since loading: %s" % ", ".join(conflicts))
+        taken = [ idx for idx in sorted(self._added) if current.get(idx) is not None ]
+        if taken:
+            self._renumber(taken, self._max_stored_id(path))
+
+    def _renumber(self, ids, max_stored_idx):
+        for idx in ids:
+            self.max_idx = max(self.max_idx, max_stored_idx) + 1
+            item = self._items.pop(idx)
+            item['id'] = self.max_idx
+            self._items[self.max_idx] = item
+            self._dirty.discard(idx)
+            self._dirty.add(self.max_idx)
+            self._added.discard(idx)
+            self._added.add(self.max_idx)
+        self._item_list = None
+        self._postings = None
+
+    def refresh(self):
+        # take over what others saved since loading. Items that did not
+        # change on disk are kept, changed and added ones are read again
+        # when they are accessed. A store with unsaved changes is left
+        # alone. Returns whether board.kbb was read again.
+        path = self.kbstore_path
+        if path is None or self._dirty or self._removed or self._events or self.board != self._saved_board:
+            return False
+        stored = self._stored_versions(path)
+        if stored is not None:
+            self._refresh_items(stored)
+        board_version = file_version(pathlib.Path(path) / BOARD_FILE)
+        if board_version == self._board_version:
+            return False
+        self._board_version = board_version
+        self.board = load_board(path)
+        self.fsync = self.board.get('fsync', True)
+        self._saved_board = copy.deepcopy(self.board)
+        return True
+
+    def _refresh_items(self, stored):
+        items = {}
+        for idx, version in stored.items():
+            item = self._items.get(idx)
+            if item is not None and self._versions.get(idx) != version:
+                item = None
+            items[idx] = item
+        if items.keys() != self._items.keys() or any( items[idx] is not item for idx, item in self._items.items() ):
+            self._versions = stored
+            self._items = items
+            self._item_list = None
+            self._postings = None
+            self._all_parsed = all( item is not None for item in items.values() )
+            self.max_idx = max(self.max_idx, max(items, default=-1))
+
+    def _stored_versions(self, path):
+        # id -> version of all stored items, or None if the store can tell
+        # that none changed since it last looked
+        raise NotImplementedError
+
+    def _current_versions(self, path, ids):
+        # id -> version on disk, or None if the item is not stored
+        raise NotImplementedError
+
+    def _max_stored_id(self, path):
+        raise NotImplementedError
+
+    def _load_items(self, path):
+        raise NotImplementedError
+
+    def _list_item_ids(self, path):
+        raise NotImplementedError
+
+    def _read_item(self, idx):
+        raise NotImplementedError
+
+    def _parse_all(self):
+        # parse everything in one go, so that stores can use their fastest
+        # way of loading. Items that were already parsed may have been
+        # changed and are kept, with the version they were read at.
+        versions = { idx: self._versions[idx] for idx, item in self._items.items()
+                if item is not None and idx in self._versions }
+        loaded = { i['id']: self._from_disk(i) for i in self._load_items(self.kbstore_path) }
+        self._versions.update(versions)
+        items = {}
+        for idx, item in self._items.items():
+            if item is None:
+                item = loaded.get(idx)
+                if item is None:
+                    # removed since the store was loaded
+                    continue
+            items[idx] = item
+        self._items = items
+        self._item_list = None
+        self._postings = None
+        self._all_parsed = True
+
+    def _save_items(self, path, items, incremental):
+        raise NotImplementedError
+
+    def _remove_items(self, path, ids):
+        raise NotImplementedError
+
+    def _write_events(self, path):
+        # items get their final id when they are saved, so it is looked up
+        # only now
+        events = [ { 'id': item['id'], 'status': status, 'date': date }
+                for item, status, date in self._events if item.get('id') is not None ]
+        if events:
+            KanbanEventLog(path).append(events, self.fsync)
+        self._events = []
+
+    def log_status_change(self, item, status, date=None):
+        # logged on the next save
+        if date is None:
+            date = datetime.datetime.now()
+        self._events.append((item, status, date))
+
+    def status_history(self, idx=None, start=None, end=None):
+        return KanbanEventLog(self.kbstore_path).events(idx, start, end)
+
+    def migrate_status_changes(self):
+        # move the _status_changes of the items into the event log, returns
+        # the number of items changed
+        n = 0
+        for item in self.items():
+            changes = item.get('_status_changes')
+            if changes is None:
+                continue
+            for change in changes:
+                self.log_status_change(item, change.get('status'), change.get('date'))
+            d = item.copy()
+            del d['_status_changes']
+            self.set_item(item['id'], d)
+            n += 1
+        return n
+
+    def _from_disk(self, item):
+        # added and changed items stay as they were given
+        if self.compact_items:
+            return CompactItem(item)
+        return item
+
+    def _create_kbstore_directory(self, path):
+        pathlib.Path(path).mkdir(parents=True, exist_ok=True)
+
+    def _save_board(self, path):
+        fn = pathlib.Path(path) / BOARD_FILE
+        write_files_atomically([ (fn, yaml.safe_dump(self.board, default_flow_style=False)) ], self.fsync)
+
+    def _dump_item(self, item):
+        d = item.copy()
+        try:
+            del d['id']
+        except KeyError:
+            pass
+        return yaml.safe_dump(d, default_flow_style=False)
+
+    def copy_from(self, other):
+        self.board = copy.deepcopy(other.get_board())
+        self._items = { i['id']: copy.deepcopy(i) for i in other.items() }
+        self._item_list = None
+        self._postings = None
+        self._all_parsed = True
+        self.max_idx = other.max_idx
+
+    def add_item(self, kwargs):
+        self.max_idx += 1
+        self._items[self.max_idx] = kwargs
+        kwargs['id'] = self.max_idx
+        self._dirty.add(self.max_idx)
+        self._added.add(self.max_idx)
+        self._postings = None
+        if self._item_list is not None:
+            self._positions[self.max_idx] = len(self._item_list)
+            self._item_list.append(kwargs)
+
+    def items(self):
+        if not self._all_parsed:
+            self._parse_all()
+        if self._item_list is None:
+            self._item_list = list(self._items.values())
+            self._positions = { idx: pos for pos, idx in enumerate(self._items) }
+        return self._item_list
+
+    def item_counts(self):
+        # the number of items, and how many of them have been parsed
+        return len(self._items), sum( 1 for item in self._items.values() if item is not None )
+
+    def get_item(self, idx):
+        try:
+            item = self._items[idx]
+        except KeyError:
+            raise IndexError(idx)
+        if item is None:
+            try:
+                item = self._items[idx] = self._from_disk(self._read_item(idx))
+            except FileNotFoundError:
+                # removed since the store was loaded
+                del self._items[idx]
+                raise IndexError(idx)
+        return item
+
+    def remove_item(self, idx):
+        if idx not in self._items:
+            raise IndexError(idx)
+        del self._items[idx]
+        self._dirty.discard(idx)
+        if idx in self._added:
+            self._added.discard(idx)
+        else:
+            self._removed.add(idx)
+        self._item_list = None
+        self._postings = None
+
+    def get_items(self, ids):
+        return [ self.get_item(idx) for idx in ids ]
+
+    def set_item(self, idx, keyvalues):
+        if idx not in self._items:
+            raise IndexError(idx)
+        self._items[idx] = keyvalues
+        keyvalues['id'] = idx
+        self._dirty.add(idx)
+        self._postings = None
+        if self._item_list is not None:
+            self._item_list[self._positions[idx]] = keyvalues
+
+    def edit_item(self, idx, d):
+        try:
+            item = self.get_item(idx)
+            item.update(d)
+            self._dirty.add(idx)
+            self._postings = None
+        except IndexError:
+            pass
+
+    def query_index(self, key, op, value):
+        # the ids of the items that can match key op value, or None if the
+        # index cannot tell
+        if key not in INDEXED_KEYS or op not in ('=', '~='):
+            return None
+        if self._postings is None:
+            self._postings = self._build_postings()
+        values, single_ids = self._postings[key]
+        ids = values.get(value, set())
+        if op == '~=':
+            # single values are matched by substring
+            ids = ids | single_ids
+        return ids
+
+    def _build_postings(self):
+        unparsed = [ idx for idx, item in self._items.items() if item is None ]
+        stored = self._stored_index_entries(unparsed)
+        postings = [ ({}, set()) for key in INDEXED_KEYS ]
+        for idx, item in self._items.items():
+            entry = stored[idx] if item is None else index_entry(item)
+            for (values, single_ids), (item_values, is_list) in zip(postings, entry):
+                for v in item_values:
+                    values.setdefault(v, set()).add(idx)
+                if not is_list:
+                    single_ids.add(idx)
+        return dict(zip(INDEXED_KEYS, postings))
+
+    def _stored_index_entries(self, ids):
+        # index entries of items that have not been parsed yet. Stores that
+        # keep an index on disk can avoid parsing them.
+        entries = {}
+        for idx in ids:
+            try:
+                entries[idx] = index_entry(self.get_item(idx))
+            except IndexError:
+                pass
+        return entries
+
+    def get_board(self):
+        return self.board
+
+    def get_plugin_conf(self, plugin_name):
+        plugins = self.get_board().get('plugin_conf', [])
+        plugin_conf = [ p for p in plugins if plugin_name in p ]
+        if plugin_conf:
+            return plugin_conf[0][plugin_name]
+        return {}
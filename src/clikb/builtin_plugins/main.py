@@ -1,10 +1,10 @@
-
+import copy
 from clikb.base_kanban_plugin import BaseKanbanPlugin
 
 class KanbanPlugin(BaseKanbanPlugin):
 
     def list_do(self):
-        for item in self.kanban_store.items():
+        for item in self.kanban_app.items():
             try:
                 print("%(id)d\t%(description)s" % item)
             except KeyError:
@@ -36,7 +36,7 @@ class KanbanPlugin(BaseKanbanPlugin):
     def add_pre(self, editor):
         self.set_default_fields(editor)
         defaults = self.kanban_store.get_board().get('default_fields', {})
-        editor.set_item(defaults)
+        editor.set_item(copy.deepcopy(defaults))
 
     def add_edit(self, editor):
         editor.edit_item()
@@ -1,12 +1,24 @@
 #!/usr/bin/env python3
 
+from .base_kanban_store import load_board, BOARD_FILE, EVENT_LOG_FILE, KanbanStoreConflict
 from .kanban_directory_store import KanbanDirectoryStore
+from .kanban_packed_store import KanbanPackedStore
 from .kanban_item_editor import KanbanItemEditor
 from .kanban_board_renderer import *
-import importlib
+from .kanban_plugin_registry import KanbanPluginRegistry
+from .kanban_hook_dispatcher import KanbanHookDispatcher
+from .kanban_query import KanbanQuery
+from .kanban_profiler import KanbanProfiler
+from .kanban_archive import KanbanArchive, ARCHIVE_FILE, archive_items, archive_policy_items
+from .kanban_stats import KanbanFlowStats, PERCENTILES
+import contextlib
+import json
+import os
 import pathlib
+import shlex
+import shutil
+import sys
 import click
-import pkg_resources
 import logging
 
 class DefaultCmdGroup(click.Group):
@@ -28,6 +40,13 @@ class DefaultCmdGroup(click.Group):
 
 KANBAN_STORE_ENVVAR='KANBAN_STORE'
 KANBAN_PLUGIN_PATH_ENVVAR='KANBAN_PLUGIN_PATH'
+KANBAN_STORE_BACKEND_ENVVAR='KANBAN_STORE_BACKEND'
+KANBAN_PARALLEL_LOAD_ENVVAR='KANBAN_PARALLEL_LOAD'
+
+kanban_stores = {
+        'directory': KanbanDirectoryStore,
+        'packed': KanbanPackedStore,
+}
 
 def kanbanstore_defined(command_ctx):
     return command_ctx.parent.params['kanban_store'] is not None
@@ -36,6 +55,19 @@ def check_kanbanstore_defined(command_ctx):
     if not kanbanstore_defined(command_ctx):
         command_ctx.fail("Kanban store undefined, please set %s or use --kanban-store" % KANBAN_STORE_ENVVAR)
 
+@contextlib.contextmanager
+def exit_on_broken_pipe(kanban_app):
+    try:
+        yield
+    except BrokenPipeError:
+        # the reader went away, e.g. when piped into head. Point stdout to
+        # devnull, so that flushing it on exit does not fail again, unless
+        # the shell carries on with the next command.
+        if not kanban_app.in_shell:
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, sys.stdout.fileno())
+        raise click.exceptions.Exit(1)
+
 def parse_keyvalues(keyvalues, default_key):
     key_values = [ a.split('=',maxsplit=1) for a in keyvalues ]
 
@@ -58,11 +90,21 @@ def parse_keyvalues(keyvalues, default_key):
 @click.option('-v', '--verbose', is_flag=True)
 @click.option('-d', '--kanban-store', envvar=KANBAN_STORE_ENVVAR, type=click.Path())
 @click.option('-P', '--kanban-plugin-path', envvar=KANBAN_PLUGIN_PATH_ENVVAR, type=str)
+@click.option('-B', '--store-backend', envvar=KANBAN_STORE_BACKEND_ENVVAR, type=click.Choice(kanban_stores.keys()))
+# processes that parse item files on cold loads, 0 for none
+@click.option('--parallel-load', envvar=KANBAN_PARALLEL_LOAD_ENVVAR, type=int)
+# time the phases of a command and print a summary, or write the timings to
+# a .json file or cProfile statistics to any other file
+@click.option('--profile', is_flag=True)
+@click.option('--profile-file', type=click.Path(dir_okay=False, writable=True))
 @click.pass_context
-def app(ctx, verbose, kanban_store, kanban_plugin_path):
+def app(ctx, verbose, kanban_store, kanban_plugin_path, store_backend, parallel_load, profile, profile_file):
     ctx.obj = KanbanApp(ctx)
     if verbose:
         logging.basicConfig(level=logging.DEBUG)
+    if profile or profile_file:
+        ctx.obj.profiler = KanbanProfiler(profile_file)
+        ctx.call_on_close(ctx.obj.report_profile)
 
 
 @app.command()
@@ -71,7 +113,7 @@ def app(ctx, verbose, kanban_store, kanban_plugin_path):
 def init(ctx, template):
     check_kanbanstore_defined(ctx)
     board_dir = pathlib.Path(ctx.parent.params['kanban_store'])
-    board_file = board_dir / "board.kbb"
+    board_file = board_dir / BOARD_FILE
     if board_file.exists():
         ctx.fail("Directory already initialized.")
     try:
@@ -101,45 +143,204 @@ show_field_format:
     default: '%(id)3d %(description)s'
 """)
 
+def copy_store_logs(source_dir, dest_dir):
+    # the files that stores only append to are copied as they are
+    for name in [ ARCHIVE_FILE, EVENT_LOG_FILE ]:
+        if (source_dir / name).exists():
+            shutil.copyfile(source_dir / name, dest_dir / name)
+
+@app.command('import')
+@click.argument('source', type=click.Path(exists=True, file_okay=False))
+@click.pass_context
+def import_store(ctx, source):
+    check_kanbanstore_defined(ctx)
+    board_dir = pathlib.Path(ctx.parent.params['kanban_store'])
+    if (board_dir / BOARD_FILE).exists():
+        ctx.fail("Directory already initialized.")
+    source_store = KanbanDirectoryStore()
+    source_store.load(pathlib.Path(source))
+    backend = ctx.parent.params.get('store_backend') or 'packed'
+    store = kanban_stores[backend]()
+    store.copy_from(source_store)
+    store.get_board()['store_backend'] = backend
+    store.save(board_dir)
+    copy_store_logs(pathlib.Path(source), board_dir)
+
+
+@app.command('export')
+@click.argument('destination', type=click.Path(file_okay=False))
+@click.pass_context
+def export_store(ctx, destination):
+    check_kanbanstore_defined(ctx)
+    dest_dir = pathlib.Path(destination)
+    if (dest_dir / BOARD_FILE).exists():
+        ctx.fail("Directory already initialized.")
+    # in the shell, the plugins keep the store that is already loaded
+    if ctx.obj.kanban_store is None:
+        ctx.obj.load_kanban_store()
+    store = KanbanDirectoryStore()
+    store.copy_from(ctx.obj.kanban_store)
+    store.get_board().pop('store_backend', None)
+    store.save(dest_dir)
+    copy_store_logs(ctx.obj.kanban_store.kbstore_path, dest_dir)
+
+
 renderers = {
         'console': KanbanBoardConsoleRenderer,
         'csv': KanbanBoardCSVRenderer,
+        'jsonl': KanbanBoardJSONLRenderer,
+        'msgpack': KanbanBoardMsgpackRenderer,
+}
+
+# renderers that write one record per item, for list
+record_renderers = {
+        'jsonl': KanbanBoardJSONLRenderer,
+        'msgpack': KanbanBoardMsgpackRenderer,
 }
 
 @app.command()
 @click.option('--field-format', default='default')
 @click.option('--out-format', default='console')
 @click.option('-o','--out-file', type=click.File("w"), default='-')
+@click.option('-q','--query')
+# show the archived items instead
+@click.option('--archived', is_flag=True)
 @click.pass_context
-def show(ctx, field_format, out_format, out_file):
+def show(ctx, field_format, out_format, out_file, query, archived):
     check_kanbanstore_defined(ctx)
     ctx.obj.initialize()
-    plugins = ctx.obj.plugins()
+    ctx.obj.set_query(query)
+    ctx.obj.archived = archived
     try:
-        field_fmt = ctx.obj.kanban_store.get_board().get('show_field_format')[out_format][field_format]
-        renderer = renderers[out_format](ctx.obj, field_fmt, out_file)
+        renderer_class = renderers[out_format]
+        field_fmt = (ctx.obj.kanban_store.get_board().get('show_field_format') or {}).get(out_format, {}).get(field_format)
+        if field_fmt is None and (renderer_class.field_format_required or field_format != 'default'):
+            raise KeyError(field_format)
+        renderer = renderer_class(ctx.obj, field_fmt, out_file)
     except KeyError:
         ctx.fail("No such output format/format name: %s/%s" % (out_format, field_format))
-    for p in plugins:
-        p.show_pre(renderer)
-    for p in plugins:
-        p.show_do(renderer)
-    for p in plugins:
-        p.show_post(renderer)
+    ctx.obj.profile_method(renderer, 'render', 'render')
+    with exit_on_broken_pipe(ctx.obj):
+        ctx.obj.run_hooks('show', renderer)
+    if renderer.column_items is not None:
+        ctx.obj.profile_count('items shown', len(renderer.column_items))
 
 
 @app.command()
+@click.option('-q','--query')
+@click.option('--archived', is_flag=True)
+# text, or a record per item with all fields
+@click.option('--out-format', type=click.Choice([ 'text' ] + sorted(record_renderers)), default='text')
+@click.option('-o','--out-file', type=click.File("w"), default='-')
+@click.pass_context
+def list(ctx, query, archived, out_format, out_file):
+    check_kanbanstore_defined(ctx)
+    ctx.obj.initialize()
+    ctx.obj.set_query(query)
+    ctx.obj.archived = archived
+    if out_format == 'text':
+        with exit_on_broken_pipe(ctx.obj), contextlib.redirect_stdout(out_file):
+            ctx.obj.run_hooks('list')
+        return
+    renderer = record_renderers[out_format](ctx.obj, None, out_file)
+    # plugins add their computed fields in show_pre
+    ctx.obj.dispatch('show', 'pre', renderer)
+    with exit_on_broken_pipe(ctx.obj):
+        renderer.render_items(ctx.obj.items())
+    ctx.obj.dispatch('show', 'post', renderer)
+
+@app.command()
+@click.argument('item-ids', type=int, nargs=-1)
+@click.pass_context
+def archive(ctx, item_ids):
+    check_kanbanstore_defined(ctx)
+    ctx.obj.initialize()
+    store = ctx.obj.kanban_store
+    if item_ids:
+        ids = item_ids
+    else:
+        # without ids, archive what the policy in board.kbb selects
+        policy = store.get_board().get('archive_policy')
+        if policy is None:
+            ctx.fail("No item ids given and no archive_policy in %s" % BOARD_FILE)
+        ids = [ item['id'] for item in archive_policy_items(store, policy) ]
+    try:
+        n = archive_items(store, ids)
+    except IndexError as e:
+        ctx.fail("No such item: %d" % e.args[0])
+    except KanbanStoreConflict as e:
+        ctx.fail(e.args[0])
+    click.echo("archived %d items" % n)
+
+
+@app.command('migrate-history')
 @click.pass_context
-def list(ctx):
+def migrate_history(ctx):
     check_kanbanstore_defined(ctx)
     ctx.obj.initialize()
-    plugins = ctx.obj.plugins()
-    for p in plugins:
-        p.list_pre()
-    for p in plugins:
-        p.list_do()
-    for p in plugins:
-        p.list_post()
+    store = ctx.obj.kanban_store
+    n = store.migrate_status_changes()
+    try:
+        store.save()
+    except KanbanStoreConflict as e:
+        ctx.fail(e.args[0])
+    click.echo("moved the status changes of %d items to %s" % (n, EVENT_LOG_FILE))
+
+
+@app.command()
+# throughput is shown for this many weeks
+@click.option('--weeks', type=int, default=12)
+# print the cumulative flow diagram data as CSV
+@click.option('--cfd', is_flag=True)
+@click.option('--json', 'as_json', is_flag=True)
+@click.pass_context
+def stats(ctx, weeks, cfd, as_json):
+    check_kanbanstore_defined(ctx)
+    # only the board and the event log are needed
+    kanbanstore_dir = pathlib.Path(ctx.parent.params['kanban_store'])
+    board = load_board(kanbanstore_dir)
+    statuses = board.get('show_statuses', [])
+    if statuses == []:
+        ctx.fail("No show_statuses in %s" % BOARD_FILE)
+    conf = board.get('stats', {})
+    start_status = conf.get('start_status', statuses[min(1, len(statuses) - 1)])
+    done_status = conf.get('done_status', statuses[-1])
+    flow = KanbanFlowStats(kanbanstore_dir)
+    flow.load()
+    flow.update()
+    report = flow.report(statuses, start_status, done_status)
+    if flow.changed:
+        flow.save()
+    if as_json:
+        click.echo(json.dumps(report, indent=1))
+        return
+    if cfd:
+        import csv
+        w = csv.writer(sys.stdout)
+        w.writerow([ 'date' ] + statuses)
+        w.writerows(report['cfd']['days'])
+        return
+    click.echo("%d items with history, %d reached %s" % (report['items'], report['done'], done_status))
+    for title, key in [ ("lead time (days)", 'lead_time_days'), ("cycle time from %s (days)" % start_status, 'cycle_time_days') ]:
+        values = report[key]
+        click.echo("%-32s %s" % (title, '  '.join( 'p%d %s' % (p, '-' if values[p] is None else '%.1f' % values[p])
+            for p in PERCENTILES )))
+    click.echo("throughput per week")
+    for week, n in sorted(report['throughput'].items())[-weeks:]:
+        click.echo("  %s %5d" % (week, n))
+
+
+def add_item(kanban_app, keyvalues):
+    editor = KanbanItemEditor(kanban_app, None, keyvalues)
+    kanban_app.run_hooks('add', editor)
+    return editor
+
+
+def edit_item(kanban_app, item_id, keyvalues):
+    editor = KanbanItemEditor(kanban_app, item_id, keyvalues)
+    kanban_app.run_hooks('edit', editor)
+    return editor
+
 
 @app.command()
 @click.argument('keyvalues', nargs=-1, required=False)
@@ -151,16 +352,7 @@ def add(ctx, keyvalues):
         d = parse_keyvalues(keyvalues, default_key='description')
     except ValueError as e:
         ctx.fail(e.args[0])
-    editor = KanbanItemEditor(ctx.obj, None, d)
-    plugins = ctx.obj.plugins()
-    for p in plugins:
-        p.add_pre(editor)
-    for p in plugins:
-        p.add_edit(editor)
-    for p in plugins:
-        p.add_save(editor)
-    for p in plugins:
-        p.add_post(editor)
+    add_item(ctx.obj, d)
 
 
 @app.command()
@@ -174,58 +366,240 @@ def edit(ctx, item_id, keyvalues):
         d = parse_keyvalues(keyvalues, default_key='status')
     except ValueError as e:
         ctx.fail(e.args[0])
-    editor = KanbanItemEditor(ctx.obj, item_id, d)
-    plugins = ctx.obj.plugins()
-    for p in plugins:
-        p.edit_pre(editor)
-    for p in plugins:
-        p.edit_edit(editor)
-    for p in plugins:
-        p.edit_save(editor)
-    for p in plugins:
-        p.edit_post(editor)
+    edit_item(ctx.obj, item_id, d)
+
+
+def parse_batch_line(line):
+    # returns the item id (None to add an item) and the values to set
+    if line.startswith('{'):
+        d = json.loads(line)
+        if not isinstance(d, dict):
+            raise ValueError("JSON line needs to be an object")
+        item_id = d.pop('id', None)
+        if item_id is not None and not isinstance(item_id, int):
+            raise ValueError("id needs to be a number")
+    else:
+        args = shlex.split(line)
+        if args[0] == 'add':
+            item_id = None
+            d = parse_keyvalues(args[1:], default_key='description')
+        elif args[0].isnumeric():
+            item_id = int(args[0])
+            d = parse_keyvalues(args[1:], default_key='status')
+        else:
+            raise ValueError("line needs to start with an item id or add")
+    if d == {}:
+        raise ValueError("nothing to change")
+    return item_id, d
+
+
+@app.command()
+@click.argument('batch-file', type=click.File("r"), default='-')
+@click.pass_context
+def batch(ctx, batch_file):
+    check_kanbanstore_defined(ctx)
+    ctx.obj.initialize()
+    store = ctx.obj.kanban_store
+    failed = 0
+    with store.deferred_save():
+        for lineno, line in enumerate(batch_file, 1):
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            try:
+                item_id, d = parse_batch_line(line)
+                if item_id is None:
+                    editor = add_item(ctx.obj, d)
+                    result = "added %d" % editor.get_item()['id']
+                else:
+                    edit_item(ctx.obj, item_id, d)
+                    result = "edited %d" % item_id
+            except (ValueError, click.ClickException) as e:
+                failed += 1
+                result = "error: %s" % (e.format_message() if isinstance(e, click.ClickException) else e)
+            click.echo("%d\t%s" % (lineno, result))
+    try:
+        store.save()
+    except KanbanStoreConflict as e:
+        ctx.fail(e.args[0])
+    if failed:
+        ctx.exit(1)
+
+
+def run_shell_command(group_ctx, args):
+    # run a command with the app of the shell, returns whether it succeeded
+    try:
+        cmd_name, cmd, args = group_ctx.command.resolve_command(group_ctx, args)
+        if cmd_name == 'shell':
+            raise click.UsageError("Already in the shell.")
+        with cmd.make_context(cmd_name, args, parent=group_ctx) as cmd_ctx:
+            cmd.invoke(cmd_ctx)
+    except click.ClickException as e:
+        click.echo("Error: %s" % e.format_message(), err=True)
+        return False
+    except click.exceptions.Exit as e:
+        return e.exit_code == 0
+    except click.Abort:
+        click.echo("Aborted!", err=True)
+        return False
+    return True
+
+
+@app.command()
+@click.pass_context
+def shell(ctx):
+    check_kanbanstore_defined(ctx)
+    try:
+        import readline
+    except ImportError:
+        pass
+    kanban_app = ctx.obj
+    kanban_app.initialize()
+    kanban_app.in_shell = True
+    while True:
+        try:
+            line = input('clikb> ')
+        except EOFError:
+            break
+        except KeyboardInterrupt:
+            click.echo()
+            continue
+        try:
+            args = shlex.split(line)
+        except ValueError as e:
+            click.echo("Error: %s" % e, err=True)
+            continue
+        if args == []:
+            continue
+        if args[0] in ('exit', 'quit'):
+            break
+        kanban_app.refresh()
+        if not run_shell_command(ctx.parent, args):
+            kanban_app.reload()
+
 
 class KanbanApp:
 
     def __init__(self, parent_ctx):
         self.parent_ctx = parent_ctx
+        self.query = None
+        # commands work on the archived items instead of the store
+        self.archived = False
+        self.profiler = None
+        self.kanban_store = None
+        # commands are run by the shell
+        self.in_shell = False
 
     def initialize(self):
-        self._load_kanban_store()
+        # the commands run in a shell share the app it initialized
+        if self.kanban_store is not None:
+            return
+        with self.profile('store load'):
+            self.load_kanban_store()
+        self._load_plugins()
+
+    def profile(self, name):
+        if self.profiler is None:
+            return contextlib.ExitStack()
+        return self.profiler.phase(name)
+
+    def profile_method(self, obj, method_name, name):
+        if self.profiler is not None:
+            self.profiler.wrap(obj, method_name, name)
+
+    def profile_count(self, name, n):
+        if self.profiler is not None:
+            self.profiler.count(name, n)
+
+    def report_profile(self):
+        store = self.kanban_store
+        if store is not None:
+            items, parsed = store.item_counts()
+            self.profiler.count('items', items)
+            self.profiler.count('items parsed', parsed)
+        dispatcher = getattr(self, 'dispatcher', None)
+        if dispatcher is not None:
+            self.profiler.hook_timings = dispatcher.timings
+        self.profiler.report()
+
+    def refresh(self):
+        # take over changes made outside the shell
+        self.query = None
+        self.archived = False
+        if self.kanban_store.refresh():
+            self._load_plugins()
+
+    def reload(self):
+        # drop what a failed command left unsaved
+        self.kanban_store.load(self.kanban_store.kbstore_path)
         self._load_plugins()
 
     def plugins(self):
         return self._plugins
 
+    def dispatch(self, command, phase, *args):
+        self.dispatcher.dispatch(command, phase, *args)
+
+    def run_hooks(self, command, *args):
+        self.dispatcher.run(command, *args)
+
+    def set_query(self, query):
+        if query is None:
+            self.query = None
+            return
+        date_format = self.kanban_store.get_board().get('date_format', '%Y-%m-%d')
+        try:
+            self.query = KanbanQuery.parse(query, date_format)
+        except ValueError as e:
+            self.error(e.args[0])
+
+    def items(self):
+        # the items that commands work on
+        if self.archived:
+            items = KanbanArchive(self.kanban_store.kbstore_path).items()
+            if self.query is None:
+                return items
+            return [ i for i in items if self.query.matches(i) ]
+        if self.query is None:
+            return self.kanban_store.items()
+        return self.query.select(self.kanban_store)
+
     def error(self, msg):
         self.parent_ctx.fail(msg)
 
-    def _load_kanban_store(self):
+    def load_kanban_store(self):
         kanbanstore_dir = pathlib.Path(self.parent_ctx.params['kanban_store'])
-        self.kanban_store = KanbanDirectoryStore()
+        backend = self.parent_ctx.params.get('store_backend') or \
+            load_board(kanbanstore_dir).get('store_backend', 'directory')
+        try:
+            store_class = kanban_stores[backend]
+        except KeyError:
+            self.error("No such store backend: %s" % backend)
+        # items are parsed when a command first touches them
+        if store_class is KanbanDirectoryStore:
+            self.kanban_store = KanbanDirectoryStore(cache=True, lazy=True,
+                    parallel_load=self.parent_ctx.params.get('parallel_load'))
+        else:
+            self.kanban_store = store_class(lazy=True)
         self.kanban_store.load(kanbanstore_dir)
+        self.profile_method(self.kanban_store, '_parse_all', 'store parse')
+        self.profile_method(self.kanban_store, '_read_item', 'store read item')
+        self.profile_method(self.kanban_store, 'save', 'store save')
 
-    def _load_plugin(self, app, plugin_name):
-        builtin_plugin_dir = pkg_resources.resource_filename('clikb', 'builtin_plugins')
-        plugin_path = self.parent_ctx.params['kanban_plugin_path'].split(':') + [builtin_plugin_dir]
-        logging.debug(f'plugin path: {plugin_path}')
-        for fn in plugin_path:
-            p = pathlib.Path(fn)
-            try:
-                spec = importlib.util.spec_from_file_location(plugin_name, p / (plugin_name + '.py'))
-                m = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(m)
-                return m.KanbanPlugin(app)
-            except FileNotFoundError as e:
-                pass
-
-        raise ModuleNotFoundError(plugin_name)
+    def _load_plugin(self, registry, plugin_name):
+        m = registry.load_module(plugin_name)
+        return m.KanbanPlugin(self)
 
     def _load_plugins(self):
+        registry = KanbanPluginRegistry(self.parent_ctx.params.get('kanban_plugin_path'))
+        logging.debug(f'plugin path: {registry.plugin_path}')
         self._plugins = []
         for p in self.kanban_store.get_board()['plugins'] + ['main']:
-            plugin = self._load_plugin(self, p)
+            with self.profile('plugin import %s' % p):
+                plugin = self._load_plugin(registry, p)
             self._plugins.append(plugin)
+        self.dispatcher = KanbanHookDispatcher(self._plugins)
+        self.dispatcher.timed = self.profiler is not None
 
     def get_show_field_format(self, fmtname):
         return self.kanban_store.get_board().get('show_field_format')[fmtname]
@@ -0,0 +1,110 @@
+import datetime
+import gzip
+import os
+import pathlib
+import zlib
+import yaml
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+from .base_kanban_store import fsync_directory
+from .kanban_item import plain
+from .kanban_query import KanbanQuery, Condition
+
+ARCHIVE_FILE = 'archive.kba'
+
+class KanbanArchive:
+    # items moved out of a store. Every append adds a gzip member with the
+    # items as YAML documents, so that the file is never rewritten.
+
+    def __init__(self, path):
+        self.fn = pathlib.Path(path) / ARCHIVE_FILE
+
+    def append(self, items, fsync=True):
+        text = yaml.safe_dump_all([ plain(i) for i in items ], explicit_start=True, default_flow_style=False)
+        new = not self.fn.exists()
+        with self.fn.open("ab") as f:
+            f.write(gzip.compress(text.encode('utf-8')))
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        if fsync and new:
+            fsync_directory(self.fn.parent)
+
+    def items(self):
+        try:
+            data = self.fn.read_bytes()
+        except FileNotFoundError:
+            return []
+        texts = []
+        while data:
+            d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            text = d.decompress(data)
+            if not d.eof:
+                # a torn append, its items are still in the store
+                break
+            texts.append(text)
+            data = d.unused_data
+        # an item archived again after a failed save replaces the old copy
+        items = {}
+        for text in texts:
+            for item in yaml.load_all(text, Loader=SafeLoader):
+                items[item['id']] = item
+        return [ items[idx] for idx in sorted(items) ]
+
+
+def event_time(event):
+    date = event.get('date')
+    if isinstance(date, datetime.datetime):
+        return date.timestamp()
+    return float('-inf')
+
+def archive_policy_items(store, policy, today=None):
+    # the items that have had the policy's status for at least its number
+    # of days, according to the event log or their _status_changes
+    if today is None:
+        today = datetime.date.today()
+    status = policy.get('status', 'DONE')
+    cutoff = today - datetime.timedelta(days=policy.get('days', 30))
+    # the latest change per item, migrated history is logged after the
+    # events that were logged before the migration
+    last_changes = {}
+    for e in store.status_history():
+        last = last_changes.get(e['id'])
+        if last is None or event_time(e) >= event_time(last):
+            last_changes[e['id']] = e
+    # not parsed from a query string, statuses can have spaces
+    query = KanbanQuery([ Condition('status', '=', status, '%Y-%m-%d', today) ])
+    selected = []
+    for item in query.select(store):
+        change = last_changes.get(item['id'])
+        if change is None:
+            changes = item.get('_status_changes') or []
+            if changes == []:
+                continue
+            change = changes[-1]
+        if change.get('status') != status:
+            continue
+        changed = change.get('date')
+        if isinstance(changed, datetime.datetime):
+            changed = changed.date()
+        if isinstance(changed, datetime.date) and changed <= cutoff:
+            selected.append(item)
+    return selected
+
+def archive_items(store, ids):
+    # append the items to the archive of the store, then remove them from
+    # the store. Returns the number of archived items. All ids are checked
+    # before anything is archived.
+    ids = sorted(set(ids))
+    if ids == []:
+        return 0
+    items = store.get_items(ids)
+    KanbanArchive(store.kbstore_path).append(items, store.fsync)
+    for idx in ids:
+        store.remove_item(idx)
+    board = store.get_board()
+    board['max_archived_id'] = max(board.get('max_archived_id', -1), ids[-1])
+    store.save()
+    return len(ids)
@@ -1,43 +1,197 @@
+import datetime
 import itertools
+import json
+import re
 import shutil
-from collections import defaultdict, OrderedDict
-import csv
-import io
-import wcwidth
+from collections import OrderedDict
+from collections.abc import Mapping
+
+def freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, Mapping):
+        return tuple((k, freeze(v)) for k,v in value.items())
+    return value
+
+
+class FieldTemplate:
+
+    format_key_re = re.compile(r'%%|%\(([^)]*)\)')
+
+    def __init__(self, text):
+        self.text = text
+        keys = [ k for k in self.format_key_re.findall(text) if k ]
+        self.keys = list(OrderedDict.fromkeys(keys))
+
+    def render(self, d):
+        return self.text % d
+
+
+class RenderItem(dict):
+    __slots__ = ()
+
+    def __missing__(self, key):
+        return '?'
+
+
+class ComputedField:
+
+    # results of computed fields that declare their dependencies, shared by
+    # all renders in this process
+    cache = {}
+    max_cache_size = 100000
+
+    def __init__(self, key, func, depends=None, context=()):
+        # depends lists the item keys (including earlier computed fields)
+        # the result is computed from, context holds other hashable values
+        # it depends on, such as today's date or configuration
+        self.key = key
+        self.func = func
+        self.depends = depends
+        self.context = freeze(context)
+
+    def __call__(self, d):
+        if self.depends is None:
+            return self.func(d)
+        cache_key = (self.key, self.func, self.context, tuple(freeze(d.get(k)) for k in self.depends))
+        try:
+            return self.cache[cache_key]
+        except KeyError:
+            pass
+        except TypeError:
+            # unhashable values cannot be cached
+            return self.func(d)
+        value = self.func(d)
+        if len(self.cache) >= self.max_cache_size:
+            self.cache.clear()
+        self.cache[cache_key] = value
+        return value
+
+
+class ComputedColumns:
+
+    def __init__(self, renderer, keys, func):
+        # func computes the values of keys for a list of items in one go,
+        # and returns a tuple of values per item
+        self.renderer = renderer
+        self.keys = keys
+        self.func = func
+        self.batch = None
+        self.values = None
+
+    def lookup(self, item):
+        if self.renderer.batch_items is not self.batch:
+            # computed for the batch of items that is being rendered, at
+            # first use
+            self.batch = self.renderer.batch_items
+            items = self.batch or []
+            self.values = dict(zip([ i['id'] for i in items ], self.func(items)))
+        try:
+            return self.values[item['id']]
+        except KeyError:
+            # an item that is not in the batch
+            return self.func([item])[0]
+
+
+class ColumnField:
+
+    def __init__(self, columns, index):
+        self.key = columns.keys[index]
+        self.columns = columns
+        self.index = index
+        # computed from the stored item only
+        self.depends = []
+
+    def __call__(self, d):
+        return self.columns.lookup(d)[self.index]
+
 
 class KanbanBoardBaseRenderer:
 
+    # whether the renderer needs a format from the board's show_field_format
+    field_format_required = True
+    # the number of rows, or records, that computed columns are computed for
+    # at a time
+    batch_size = 64
+
     def __init__(self, app):
         self.app = app
         self.board = app.kanban_store.get_board()
         self.show_statuses = self.board.get('show_statuses', [])
         self.computed_fields = OrderedDict()
+        self._needed_fields = None
+        # the items shown on the board
+        self.column_items = None
+        # the items being rendered, for computed columns
+        self.batch_items = None
 
-    def add_computed_field(self, key, value):
-        self.computed_fields[key] = value
+    def add_computed_field(self, key, value, depends=None, context=()):
+        self.computed_fields[key] = ComputedField(key, value, depends, context)
+
+    def add_computed_columns(self, keys, func):
+        columns = ComputedColumns(self, keys, func)
+        for i, key in enumerate(keys):
+            self.computed_fields[key] = ColumnField(columns, i)
+
+    def compile_templates(self, texts):
+        templates = [ FieldTemplate(t) for t in texts ]
+        keys = set(k for t in templates for k in t.keys)
+        self._needed_fields = self._needed_computed_fields(keys)
+        return templates
+
+    def _needed_computed_fields(self, keys):
+        names = list(self.computed_fields)
+        needed = set(k for k in keys if k in self.computed_fields)
+        # walk backwards, so that the dependencies of a field are added
+        # before the earlier fields they refer to are visited
+        for i in reversed(range(len(names))):
+            if names[i] in needed:
+                depends = self.computed_fields[names[i]].depends
+                if depends is None:
+                    # could depend on any earlier field
+                    needed.update(names[:i])
+                else:
+                    needed.update(depends)
+        return [ f for k, f in self.computed_fields.items() if k in needed ]
+
+    def resolve(self, item):
+        d = RenderItem(item)
+        fields = self._needed_fields
+        if fields is None:
+            fields = self.computed_fields.values()
+        for f in fields:
+            d[f.key] = f(d)
+        return d
 
     def group_by_status(self):
-        items = self.app.kanban_store.items()
-        l = [ [ item for item in items if item.get('status') == k ] for k in self.show_statuses ]
-        rows = itertools.zip_longest(*l)
-        return rows
+        columns = self.bucket_by_status(self.app.items())
+        self.column_items = list(itertools.chain.from_iterable(columns))
+        rows = itertools.zip_longest(*columns)
+        return self.batched_rows(rows)
+
+    def batched_rows(self, rows):
+        # rows are rendered in batches, so that the first rows do not wait
+        # for the computed columns of the whole board
+        while True:
+            batch = list(itertools.islice(rows, self.batch_size))
+            if batch == []:
+                return
+            self.batch_items = [ i for r in batch for i in r if i is not None ]
+            yield from batch
+
+    def bucket_by_status(self, items):
+        columns = [ [] for s in self.show_statuses ]
+        column_lookup = dict(zip(self.show_statuses, columns))
+        for item in items:
+            column = column_lookup.get(item.get('status'))
+            if column is not None:
+                column.append(item)
+        return columns
 
     def render(self, rows):
         pass
 
 
-class BoardView:
-    def __init__(self, num_columns):
-        self.num_columns = num_columns
-        self.clear()
-    def clear(self):
-        self.columns = [ [] for c in range(self.num_columns) ]
-    def add_field(self, column, lines):
-        self.columns[column] += lines
-    def get_rows(self):
-        rows = itertools.zip_longest(*self.columns)
-        return rows
- 
 class KanbanBoardConsoleRenderer(KanbanBoardBaseRenderer):
 
     def __init__(self, app, field_fmt, out_file):
@@ -46,13 +200,11 @@ class KanbanBoardConsoleRenderer(KanbanBoardBaseRenderer):
         self.fieldfmt = field_fmt
         width, height = shutil.get_terminal_size() # TODO: ask click
         self.column_width = width // len(self.show_statuses)
-        self.board_view = BoardView(len(self.show_statuses))
 
     def _render_head(self):
-        for i,s in enumerate(self.show_statuses):
-            self.board_view.add_field(i, [
-                self._render_head_field1(s),
-                self._render_head_field2(s) ])
+        return [
+            [ self._render_head_field1(s) for s in self.show_statuses ],
+            [ self._render_head_field2(s) for s in self.show_statuses ] ]
 
     def _render_head_field1(self, s):
         t = "│ " + s + " " * self.column_width
@@ -63,45 +215,42 @@ class KanbanBoardConsoleRenderer(KanbanBoardBaseRenderer):
         return t[:self.column_width ]
 
     def _pad_and_truncate(self, text):
-        s = (text + " " * (self.column_width))[:self.column_width] 
+        s = text[:self.column_width].ljust(self.column_width)
+        try:
+            # str.isascii is new in Python 3.7
+            s.encode('ascii')
+        except UnicodeEncodeError:
+            pass
+        else:
+            # every character is one column wide
+            return s
+        import wcwidth
         diff = wcwidth.wcswidth(s) - len(s)
         if diff > 0:
             s = s[:-diff]
         return s
 
     def _render_field(self, field):
-        d = defaultdict( lambda : '?' )
-        d.update(field)
-        for k,v in self.computed_fields.items():
-            d[k] = v(d)
+        d = self.resolve(field)
+        return [ self._pad_and_truncate(t.render(d))
+                for t in self.templates ]
 
-        return [ self._pad_and_truncate(f['text'] % d)
-                for f in self.fieldfmt ]
+    def _render_row(self, row):
+        # every item has the same number of lines, so a row of items can
+        # be written as soon as it is rendered
+        fields = [ self._render_field(item) if item is not None else self.empty_field
+                for item in row ]
+        return [ ''.join(line) for line in zip(*fields) ]
 
-    def _render_item(self, item):
-        lines = self._render_field(item)
-        try:
-            col = self.column_lookup[item.get('status')]
-            self.board_view.add_field(col, lines)
-        except KeyError:
-            pass
+    def _write_lines(self, lines):
+        self.outfile.write(''.join( l + '\n' for l in lines ))
 
     def render(self, rows):
-        self.board_view.clear()
-        self.column_lookup = dict([ (v,i) for i,v in enumerate(self.show_statuses) ])
-        items = self.app.kanban_store.items()
-        self._render_head()
-        for i in items:
-            self._render_item(i)
-        rows = self.board_view.get_rows()
-        
+        self.templates = self.compile_templates([ f['text'] for f in self.fieldfmt ])
+        self.empty_field = [ ' ' * self.column_width ] * len(self.templates)
+        self._write_lines( ''.join(l) for l in self._render_head() )
         for row in rows:
-            for f in row:
-                if f is not None:
-                    self.outfile.write(f)
-                else:
-                    self.outfile.write(' ' * self.column_width)
-            self.outfile.write('\n')
+            self._write_lines(self._render_row(row))
 
 
 class KanbanBoardCSVRenderer(KanbanBoardBaseRenderer):
@@ -112,9 +261,7 @@ class KanbanBoardCSVRenderer(KanbanBoardBaseRenderer):
         self.fieldfmt = field_fmt
 
     def _render_field_content(self, field):
-        d = defaultdict( lambda : '?' )
-        d.update(field)
-        return self.fieldfmt % d
+        return self.template.render(self.resolve(field))
 
     def _render_field(self, field):
         if field is not None:
@@ -125,8 +272,90 @@ class KanbanBoardCSVRenderer(KanbanBoardBaseRenderer):
 
 
     def render(self, rows):
+        import csv
+        self.template, = self.compile_templates([ self.fieldfmt ])
         w = csv.writer(self.outfile)
         w.writerow(self.show_statuses)
         for r in rows:
             w.writerow( [ self._render_field(x) for x in r ])
 
+
+
+def plain_value(value):
+    # values that JSON and msgpack have no type for. Dates first, they are
+    # the most common and the Mapping check is slow.
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError("cannot encode %s" % type(value).__name__)
+
+
+class KanbanBoardJSONLRenderer(KanbanBoardBaseRenderer):
+    # one JSON object per line for every item, with its stored and its
+    # computed fields. field_fmt is a list of the keys to write, with the
+    # values that a field format would show, or None to write all stored
+    # fields as they are and the computed fields that do not replace one.
+
+    field_format_required = False
+
+    def __init__(self, app, field_fmt, out_file):
+        KanbanBoardBaseRenderer.__init__(self, app)
+        self.outfile = out_file
+        self.keys = field_fmt
+
+    def record(self, item):
+        d = self.resolve(item)
+        if self.keys is None:
+            d.update(item)
+            return d
+        return { k: d.get(k) for k in self.keys }
+
+    def _prepare(self):
+        if self.keys is not None:
+            self._needed_fields = self._needed_computed_fields(set(self.keys))
+
+    def _write_records(self, items):
+        encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=plain_value).encode
+        write = self.outfile.write
+        for batch in self.batches(items):
+            for item in batch:
+                write(encode(self.record(item)) + '\n')
+
+    def batches(self, items):
+        for start in range(0, len(items), self.batch_size):
+            self.batch_items = items[start:start+self.batch_size]
+            yield self.batch_items
+
+    def render_items(self, items):
+        # items in the order given, for commands that are not about the board
+        self.column_items = items
+        self._prepare()
+        self._write_records(items)
+
+    def render(self, rows):
+        # the items per status column, like the board
+        if self.column_items is None:
+            self.column_items = [ i for r in rows for i in r if i is not None ]
+        self._prepare()
+        self._write_records(self.column_items)
+
+
+class KanbanBoardMsgpackRenderer(KanbanBoardJSONLRenderer):
+    # the records of the JSONL renderer as a stream of msgpack maps
+
+    def __init__(self, app, field_fmt, out_file):
+        KanbanBoardJSONLRenderer.__init__(self, app, field_fmt, out_file)
+        try:
+            import msgpack
+        except ImportError:
+            app.error("msgpack output needs the msgpack package")
+
+    def _write_records(self, items):
+        import msgpack
+        packer = msgpack.Packer(default=plain_value)
+        out = getattr(self.outfile, 'buffer', self.outfile)
+        self.outfile.flush()
+        for batch in self.batches(items):
+            for item in batch:
+                out.write(packer.pack(self.record(item)))
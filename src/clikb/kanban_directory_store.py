@@ -1,101 +1,212 @@
+import os
 import pathlib
+import time
 import yaml
-
-class KanbanDirectoryStore:
-
-    def __init__(self):
-        self._items = []
-        self.kbstore_path = None
-        self.max_idx = -1
-        self.board = {}
-
-    def load(self, path):
-        self._items = [ x[1] for x in sorted([ (fn, self._load_item(fn)) for fn in filter(lambda p: p.suffix == '.kbi', path.iterdir()) ]) ]
-        if self._items != []:
-            self.max_idx = max( [ x['id'] for x in self._items ] )
-        self.board = self._load_board(path / "board.kbb")
-        self.kbstore_path = path
-
-    def save(self, path=None):
-        if not path:
-            if self.kbstore_path is not None:
-                path = self.kbstore_path
-            else:
-                raise Exception("No kbstore path")
-
-        # if self.kbstore_path is None: self.kbstore_path = path
-
-        self._create_kbstore_directory(path)
-
-        for idx,item in enumerate(self._items):
-            self._save_item(path, idx, item)
-
-        # TODO: make this optional
-        self._save_board(path)
-
-    def _create_kbstore_directory(self, path):
-        pathlib.Path(path).mkdir(parents=True, exist_ok=True)
-
-    def _save_item(self, path, idx, item):
-        fn = pathlib.Path(path) / ("%05d.kbi" % idx)
-        with fn.open("w") as f:
-            d = item.copy()
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+from .base_kanban_store import BaseKanbanStore, index_entry, write_files_atomically, file_version, fsync_directory, \
+        read_cache_file, write_cache_file
+
+CACHE_FILE = '.kbcache'
+CACHE_VERSION = 1
+INDEX_FILE = '.kbindex'
+# parallel loads hand out this many files per task, and are only used when
+# there are enough files to make up for starting the worker processes
+PARALLEL_CHUNK_SIZE = 256
+PARALLEL_MIN_FILES = 2048
+# a directory changed less than this many seconds ago can change again
+# without getting a new mtime
+LISTING_MTIME_MARGIN = 1.0
+
+def parse_item_files(fns):
+    # runs in the worker processes of parallel loads
+    items = []
+    for fn in fns:
+        with open(fn, "rb") as f:
+            items.append(yaml.load(f, Loader=SafeLoader))
+    return items
+
+def item_file_names(path):
+    # the names of the item files in id order. Sorting names is much faster
+    # than sorting paths, paths are only made for the files that are used.
+    names = [ name for name in os.listdir(path) if name.endswith('.kbi') ]
+    names.sort(key=lambda name: int(name[:-4]))
+    return names
+
+
+class KanbanDirectoryStore(BaseKanbanStore):
+
+    def __init__(self, cache=False, lazy=False, parallel_load=None):
+        BaseKanbanStore.__init__(self, lazy=lazy)
+        self.cache = cache
+        # number of processes that parse item files, True for one per core.
+        # None takes parallel_load from board.kbb, off by default.
+        self.parallel_load = parallel_load
+        # id -> item file name
+        self._item_files = {}
+        # the mtime of the directory when the item files were listed, None
+        # if it was too recent to tell later changes by
+        self._listed_version = None
+
+    def _load_items(self, path):
+        if self.cache:
+            return self._load_items_cached(path)
+        return self._parse_items([ path / name for name in item_file_names(path) ])
+
+    def _list_item_ids(self, path):
+        # stat before listing, a change while listing gives a newer mtime
+        st = os.stat(path)
+        self._item_files = { int(name[:-4]): name for name in item_file_names(path) }
+        self._listed_version = None
+        if time.time() - st.st_mtime >= LISTING_MTIME_MARGIN:
+            self._listed_version = (st.st_mtime_ns, st.st_ino)
+        return self._item_files.keys()
+
+    def _read_item(self, idx):
+        return self._load_item(self._item_file(self.kbstore_path, idx))
+
+    def _item_file(self, path, idx):
+        name = self._item_files.get(idx)
+        if name is None:
+            return self._item_path(path, idx)
+        return pathlib.Path(path) / name
+
+    def _save_items(self, path, items, incremental):
+        files = [ (self._item_file(path, item['id']) if incremental else self._item_path(path, item['id']),
+                    self._dump_item(item)) for item in items ]
+        write_files_atomically(files, self.fsync)
+        if incremental:
+            for item, (fn, text) in zip(items, files):
+                self._versions[item['id']] = file_version(fn)
+        return len(items)
+
+    def _remove_items(self, path, ids):
+        for idx in ids:
+            fn = self._item_file(path, idx)
+            self._item_files.pop(idx, None)
             try:
-                del d['id']
-            except KeyError:
+                fn.unlink()
+            except FileNotFoundError:
                 pass
-            yaml.safe_dump(d, stream=f, default_flow_style=False)
-
-    def _load_item(self, full_path):
-        idx = int(full_path.stem)
+            self._versions.pop(idx, None)
+        if self.fsync:
+            fsync_directory(path)
 
-        with full_path.open("r") as f:
-            d = yaml.safe_load(f)
-            d['id'] = idx
-            return d
+    def _current_versions(self, path, ids):
+        return { idx: file_version(self._item_file(path, idx)) for idx in ids }
 
-    def _save_board(self, path):
-        fn = pathlib.Path(path) / "board.kbb"
-        with fn.open("w") as f:
-            yaml.safe_dump(self.board, stream=f, default_flow_style=False)
+    def _stored_versions(self, path):
+        # saves rename files into place, so item files that are added,
+        # changed or removed change the directory
+        if self._listed_version is not None:
+            st = os.stat(path)
+            if (st.st_mtime_ns, st.st_ino) == self._listed_version:
+                return None
+        self._list_item_ids(path)
+        return { idx: file_version(os.path.join(path, name)) for idx, name in self._item_files.items() }
 
+    def _max_stored_id(self, path):
+        return max([ int(name[:-4]) for name in os.listdir(path) if name.endswith('.kbi') ], default=-1)
 
-    def _load_board(self, full_path):
-        with full_path.open("r") as f:
-            d = yaml.safe_load(f)
-            return d
+    def _item_path(self, path, idx):
+        return pathlib.Path(path) / ("%05d.kbi" % idx)
 
-
-    def add_item(self, kwargs):
-        self._items.append( kwargs )
-        self.max_idx += 1
-        self._items[-1]['id'] = self.max_idx
-
-    def items(self):
-        return self._items
-
-    def get_item(self, idx):
-        return [ i for i in self._items if i['id'] == idx ][0]
-
-    def set_item(self, idx, keyvalues):
-        item_index = [ k for k,i in enumerate(self._items) if i['id'] == idx ][0]
-        self._items[item_index] = keyvalues
-        self._items[item_index]['id'] = idx
-
-    def edit_item(self, idx, d):
+    def _load_item(self, full_path):
+        return self._parse_items([ full_path ])[0]
+
+    def _parse_items(self, fns):
+        # stat before reading, the version must not be newer than the content
+        for fn in fns:
+            self._versions[int(fn.stem)] = file_version(fn)
+        workers = self._parallel_workers(len(fns))
+        if workers > 1:
+            # only imported when needed, it takes a while
+            import concurrent.futures
+            chunks = [ fns[i:i+PARALLEL_CHUNK_SIZE] for i in range(0, len(fns), PARALLEL_CHUNK_SIZE) ]
+            with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+                items = [ d for chunk in executor.map(parse_item_files, chunks) for d in chunk ]
+        else:
+            items = parse_item_files(fns)
+        for fn, d in zip(fns, items):
+            d['id'] = int(fn.stem)
+        return items
+
+    def _parallel_workers(self, num_files):
+        workers = self.parallel_load
+        if workers is None:
+            workers = self.board.get('parallel_load', False)
+        if workers is True:
+            workers = os.cpu_count() or 1
+        if not workers or num_files < PARALLEL_MIN_FILES:
+            return 0
+        return min(workers, -(-num_files // PARALLEL_CHUNK_SIZE))
+
+    def _load_items_cached(self, path):
+        cached = self._read_cache(path)
+        entries = {}
+        stale = []
+        for name in item_file_names(path):
+            # stat before reading, so that a file that changes while it is
+            # read gets a stale key and is parsed again next time
+            key = self._cache_key(os.path.join(path, name))
+            entry = cached.get(name)
+            if entry is None or entry[0] != key:
+                stale.append((path / name, key))
+                entry = (key, None)
+            entries[name] = entry
+        for (fn, key), item in zip(stale, self._parse_items([ fn for fn, key in stale ])):
+            entries[fn.name] = (key, item)
+        items = []
+        for key, item in entries.values():
+            self._versions[item['id']] = key
+            items.append(item)
+        if entries != cached:
+            self._write_cache(path, entries)
+        return items
+
+    def _stored_index_entries(self, ids):
+        # the index sidecar has the index entries of all item files, keyed
+        # like the cache. Only items whose file changed are parsed.
+        path = self.kbstore_path
+        stored = self._read_cache(path, INDEX_FILE)
+        entries = {}
+        index = {}
+        for idx in ids:
+            fn = self._item_file(path, idx)
+            try:
+                key = self._cache_key(fn)
+                entry = stored.get(fn.name)
+                if entry is None or entry[0] != key:
+                    entry = (key, index_entry(self.get_item(idx)))
+            except (FileNotFoundError, IndexError):
+                continue
+            index[fn.name] = entry
+            entries[idx] = entry[1]
+        # keep the entries of the other item files that still exist
+        names = set(self._item_files.values())
+        index = { name: entry for name, entry in dict(stored, **index).items() if name in names }
+        if index != stored:
+            self._write_cache(path, index, INDEX_FILE)
+        return entries
+
+    def _cache_key(self, full_path):
+        st = os.stat(full_path)
+        return (st.st_mtime_ns, st.st_ctime_ns, st.st_size, st.st_ino)
+
+    def _read_cache(self, path, cache_file=CACHE_FILE):
+        try:
+            version, entries = read_cache_file(pathlib.Path(path) / cache_file)
+        except Exception:
+            return {}
+        if version != CACHE_VERSION:
+            return {}
+        return entries
+
+    def _write_cache(self, path, entries, cache_file=CACHE_FILE):
         try:
-            item = self.get_item(idx)
-            item.update(d)
-        except IndexError:
+            write_cache_file(pathlib.Path(path) / cache_file, (CACHE_VERSION, entries))
+        except OSError:
+            # a read-only store can still be loaded, just not cached
             pass
-
-    def get_board(self):
-        return self.board
-
-    def get_plugin_conf(self, plugin_name):
-        plugins = self.get_board().get('plugin_conf', [])
-        plugin_conf = [ p for p in plugins if plugin_name in p ]
-        if plugin_conf:
-            return plugin_conf[0][plugin_name]
-        return {}
-
@@ -0,0 +1,51 @@
+import logging
+import time
+from collections import defaultdict
+from .base_kanban_plugin import BaseKanbanPlugin
+
+# the phases of each command, in the order they are run
+COMMAND_PHASES = {
+    'list': ('pre', 'do', 'post'),
+    'show': ('pre', 'do', 'post'),
+    'edit': ('pre', 'edit', 'save', 'post'),
+    'add': ('pre', 'edit', 'save', 'post'),
+}
+
+class KanbanHookDispatcher:
+
+    def __init__(self, plugins):
+        self.plugins = plugins
+        # (plugin module, hook) -> [ number of calls, total seconds ]
+        self.timings = defaultdict(lambda: [0, 0.0])
+        # hooks are timed when debugging or when this is set
+        self.timed = False
+        # only hooks that a plugin overrides are called
+        self._hooks = {}
+        for command, phases in COMMAND_PHASES.items():
+            for phase in phases:
+                hook = command + '_' + phase
+                base_method = getattr(BaseKanbanPlugin, hook)
+                self._hooks[hook] = [ (p, getattr(p, hook)) for p in plugins
+                        if getattr(type(p), hook, base_method) is not base_method ]
+
+    def hook_plugins(self, command, phase):
+        return [ p for p, method in self._hooks[command + '_' + phase] ]
+
+    def dispatch(self, command, phase, *args):
+        hook = command + '_' + phase
+        if not self.timed and not logging.getLogger().isEnabledFor(logging.DEBUG):
+            for p, method in self._hooks[hook]:
+                method(*args)
+            return
+        for p, method in self._hooks[hook]:
+            start = time.perf_counter()
+            method(*args)
+            elapsed = time.perf_counter() - start
+            timing = self.timings[(type(p).__module__, hook)]
+            timing[0] += 1
+            timing[1] += elapsed
+            logging.debug('%s.%s took %.3f ms', type(p).__module__, hook, elapsed * 1000)
+
+    def run(self, command, *args):
+        for phase in COMMAND_PHASES[command]:
+            self.dispatch(command, phase, *args)
@@ -0,0 +1,109 @@
+import sys
+from collections.abc import Mapping, MutableMapping
+
+# strings up to this length are interned, such as statuses, tags and dates
+INTERN_MAX_LENGTH = 32
+
+# keys -> layout, shared by all items with the same keys
+_layouts = {}
+
+def compact(value):
+    if isinstance(value, str):
+        if len(value) <= INTERN_MAX_LENGTH:
+            return sys.intern(value)
+        return value
+    if isinstance(value, list):
+        return [ compact(v) for v in value ]
+    if isinstance(value, dict):
+        return CompactItem(value)
+    return value
+
+def plain(value):
+    if isinstance(value, list):
+        return [ plain(v) for v in value ]
+    if isinstance(value, Mapping):
+        return { k: plain(v) for k, v in value.items() }
+    return value
+
+def item_layout(keys):
+    try:
+        return _layouts[keys]
+    except KeyError:
+        layout = _layouts[keys] = ItemLayout(keys)
+        return layout
+
+
+class ItemLayout:
+
+    __slots__ = ('keys', 'index', '_extended')
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.index = { k: i for i, k in enumerate(keys) }
+        self._extended = {}
+
+    def extend(self, key):
+        try:
+            return self._extended[key]
+        except KeyError:
+            layout = self._extended[key] = item_layout(self.keys + (key,))
+            return layout
+
+
+class CompactItem(MutableMapping):
+    # an item that stores its values in a list, with keys that are shared
+    # with all items that have the same keys. Behaves like a dict, except
+    # that copy() returns a dict.
+
+    __slots__ = ('_layout', '_values')
+
+    def __init__(self, d=()):
+        d = dict(d)
+        self._layout = item_layout(tuple( compact(k) for k in d ))
+        self._values = [ compact(v) for v in d.values() ]
+
+    def __getitem__(self, key):
+        try:
+            return self._values[self._layout.index[key]]
+        except KeyError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        i = self._layout.index.get(key)
+        if i is None:
+            return default
+        return self._values[i]
+
+    def __contains__(self, key):
+        return key in self._layout.index
+
+    def __setitem__(self, key, value):
+        if isinstance(value, str):
+            value = compact(value)
+        i = self._layout.index.get(key)
+        if i is None:
+            self._layout = self._layout.extend(compact(key))
+            self._values.append(value)
+        else:
+            self._values[i] = value
+
+    def __delitem__(self, key):
+        i = self._layout.index[key]
+        keys = self._layout.keys
+        self._layout = item_layout(keys[:i] + keys[i+1:])
+        del self._values[i]
+
+    def __iter__(self):
+        return iter(self._layout.keys)
+
+    def __len__(self):
+        return len(self._values)
+
+    def copy(self):
+        return plain(self)
+
+    def __repr__(self):
+        return repr(plain(self))
+
+    def __reduce__(self):
+        return (CompactItem, (plain(self),))
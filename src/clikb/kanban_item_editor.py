@@ -1,6 +1,5 @@
+from .base_kanban_store import KanbanStoreConflict
 import yaml
-import tempfile
-import subprocess
 import os
 
 class KanbanItemEditor:
@@ -54,7 +53,10 @@ class KanbanItemEditor:
             self.app.kanban_store.add_item(self.item)
         else:
             self.app.kanban_store.set_item(self.item_id, self.item)
-        self.app.kanban_store.save()
+        try:
+            self.app.kanban_store.save()
+        except KanbanStoreConflict as e:
+            self.app.error(e.args[0])
 
     def _create_editor_template(self, item):
         editor_values = {}
@@ -83,6 +85,7 @@ class KanbanItemEditor:
         return "".join(template_lines)
 
     def _save_template_file(self, editor_template):
+        import tempfile
         with tempfile.NamedTemporaryFile('w', delete=False) as f:
             self.editor_file = f.name
             f.write(editor_template)
@@ -90,6 +93,7 @@ class KanbanItemEditor:
     def _launch_editor(self):
         editor_file_status = os.stat(self.editor_file)
         editor_cmd = os.environ['EDITOR']
+        import subprocess
         proc = subprocess.run([ editor_cmd, self.editor_file ])
         self.edit_changed = proc.returncode == 0 and editor_file_status != os.stat(self.editor_file)
 
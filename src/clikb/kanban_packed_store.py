@@ -0,0 +1,269 @@
+import json
+import os
+import pathlib
+import struct
+import yaml
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+from .base_kanban_store import BaseKanbanStore, index_entry, fsync_directory
+
+PACK_FILE = 'items.kbp'
+PACK_MAGIC = b'KBP1'
+INDEX_MAGIC = b'KBPINDEX'
+# the last bytes of the pack file point to the current index
+INDEX_TRAILER = struct.Struct('<8sQQ')
+# extra space that stale records may take before the pack is compacted
+COMPACT_SLACK = 65536
+
+# All items live in a single append-only file. Changed items are appended,
+# followed by a new id -> (offset, length, index entry) index and a trailer
+# that points to it. Stale records are dropped when the pack is compacted.
+class KanbanPackedStore(BaseKanbanStore):
+
+    def __init__(self, lazy=False):
+        BaseKanbanStore.__init__(self, lazy=lazy)
+        self._index = {}
+        self._pack_size = 0
+        # the pack file that the index was read from. Records are read
+        # through it, since a compaction by another writer replaces the
+        # file and moves the records.
+        self._pack = None
+
+    def __del__(self):
+        self._set_pack(None)
+
+    def _set_pack(self, f):
+        if self._pack is not None and self._pack is not f:
+            self._pack.close()
+        self._pack = f
+
+    def _load_items(self, path):
+        f, self._index, self._pack_size = self._read_stored_index(path)
+        self._set_pack(f)
+        if f is None:
+            return []
+        f.seek(0)
+        data = f.read()
+        self._set_versions()
+        items = []
+        for idx in sorted(self._index):
+            offset, length = self._index[idx][:2]
+            items.append(self._parse_record(idx, data[offset:offset+length]))
+        return items
+
+    def _list_item_ids(self, path):
+        f, self._index, self._pack_size = self._read_stored_index(path)
+        self._set_pack(f)
+        self._set_versions()
+        return sorted(self._index)
+
+    def _read_stored_index(self, path):
+        # returns the open pack file, its index and its size
+        try:
+            f = (pathlib.Path(path) / PACK_FILE).open("rb")
+        except FileNotFoundError:
+            return None, {}, 0
+        try:
+            return (f,) + self._read_index(f)
+        except BaseException:
+            f.close()
+            raise
+
+    def _set_versions(self):
+        # the location of a record is its version, records are never
+        # overwritten
+        self._versions = { idx: tuple(entry[:2]) for idx, entry in self._index.items() }
+
+    def _check_conflicts(self, path):
+        self._stored_pack, self._stored_index, self._stored_size = self._read_stored_index(path)
+        try:
+            BaseKanbanStore._check_conflicts(self, path)
+            self._merge_stored_index()
+        finally:
+            if self._stored_pack is not self._pack:
+                self._stored_pack.close()
+            self._stored_pack = None
+
+    def _current_versions(self, path, ids):
+        return { idx: tuple(self._stored_index[idx][:2]) if idx in self._stored_index else None
+                for idx in ids }
+
+    def _stored_versions(self, path):
+        f, self._index, self._pack_size = self._read_stored_index(path)
+        self._set_pack(f)
+        return { idx: tuple(entry[:2]) for idx, entry in self._index.items() }
+
+    def _max_stored_id(self, path):
+        return max(self._stored_index, default=-1)
+
+    def _merge_stored_index(self):
+        # take over what other writers saved since this store was loaded
+        if self._stored_size == self._pack_size and self._same_pack(self._stored_pack):
+            return
+        for idx in [ idx for idx in self._items if idx not in self._stored_index ]:
+            if idx not in self._dirty:
+                # removed by another writer
+                del self._items[idx]
+        for idx, entry in self._stored_index.items():
+            if idx not in self._dirty and idx not in self._removed and \
+                    tuple(entry[:2]) != tuple(self._index.get(idx, ())[:2]):
+                # changed or added by another writer, read again when needed
+                self._items[idx] = None
+                self._versions[idx] = tuple(entry[:2])
+                self._all_parsed = False
+        self._items = dict(sorted(self._items.items()))
+        self._item_list = None
+        self._postings = None
+        self.max_idx = max(self.max_idx, max(self._stored_index, default=-1))
+        self._index = { idx: entry for idx, entry in self._stored_index.items() if idx in self._items }
+        self._pack_size = self._stored_size
+        self._set_pack(self._stored_pack)
+
+    def _same_pack(self, f):
+        if f is None or self._pack is None:
+            return f is self._pack
+        return os.fstat(f.fileno()).st_ino == os.fstat(self._pack.fileno()).st_ino
+
+    def _read_item(self, idx):
+        offset, length = self._index[idx][:2]
+        self._pack.seek(offset)
+        return self._parse_record(idx, self._pack.read(length))
+
+    def _stored_index_entries(self, ids):
+        entries = {}
+        for idx in ids:
+            stored = self._index[idx]
+            if len(stored) > 2:
+                entries[idx] = tuple( (tuple(values), is_list) for values, is_list in stored[2] )
+            else:
+                try:
+                    entries[idx] = index_entry(self.get_item(idx))
+                except IndexError:
+                    pass
+        return entries
+
+    def _parse_record(self, idx, record):
+        d = yaml.load(record, Loader=SafeLoader)
+        d['id'] = idx
+        return d
+
+    def _read_index(self, f):
+        size = f.seek(0, os.SEEK_END)
+        f.seek(0)
+        if size < len(PACK_MAGIC) + INDEX_TRAILER.size or f.read(len(PACK_MAGIC)) != PACK_MAGIC:
+            raise Exception("Not a packed kanban store")
+        f.seek(size - INDEX_TRAILER.size)
+        trailer = f.read(INDEX_TRAILER.size)
+        index = self._parse_index(f, size, trailer)
+        if index is None:
+            index = self._recover_index(f)
+        return index, size
+
+    def _parse_index(self, f, end, trailer):
+        magic, offset, length = INDEX_TRAILER.unpack(trailer)
+        if magic != INDEX_MAGIC or offset + length + INDEX_TRAILER.size != end:
+            return None
+        f.seek(offset)
+        try:
+            index = json.loads(f.read(length).decode('utf-8'))
+        except ValueError:
+            return None
+        return { int(k): tuple(v) for k,v in index.items() }
+
+    def _recover_index(self, f):
+        # an append was interrupted, use the last complete index. Its
+        # records were written before it, so they are complete as well.
+        f.seek(0)
+        data = f.read()
+        end = len(data)
+        while True:
+            pos = data.rfind(INDEX_MAGIC, 0, end)
+            if pos < 0:
+                raise Exception("Corrupt packed kanban store")
+            trailer = data[pos:pos+INDEX_TRAILER.size]
+            if len(trailer) == INDEX_TRAILER.size:
+                index = self._parse_index(f, pos + INDEX_TRAILER.size, trailer)
+                if index is not None:
+                    return index
+            end = pos
+
+    def _save_items(self, path, items, incremental):
+        fn = pathlib.Path(path) / PACK_FILE
+        if incremental and fn.exists() and not self._needs_compaction():
+            index, size = self._append_pack(fn, items)
+            written = len(items)
+        else:
+            items = self.items()
+            index, size = self._rewrite_pack(fn, items)
+            written = len(items)
+        if incremental:
+            self._index = index
+            self._pack_size = size
+            self._set_pack(fn.open("rb"))
+            for item in items:
+                self._versions[item['id']] = tuple(index[item['id']][:2])
+        return written
+
+    def _remove_items(self, path, ids):
+        fn = pathlib.Path(path) / PACK_FILE
+        if not fn.exists():
+            return
+        # the records stay until the next compaction
+        index = { idx: entry for idx, entry in self._index.items() if idx not in ids }
+        with fn.open("ab") as f:
+            f.seek(0, os.SEEK_END)
+            size = self._write_index(f, f.tell(), index)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        self._index = index
+        self._pack_size = size
+        self._set_pack(fn.open("rb"))
+        for idx in ids:
+            self._versions.pop(idx, None)
+
+    def _needs_compaction(self):
+        live = sum( entry[1] for entry in self._index.values() )
+        return self._pack_size > 2 * live + COMPACT_SLACK
+
+    def _append_pack(self, fn, items):
+        index = dict(self._index)
+        with fn.open("ab") as f:
+            f.seek(0, os.SEEK_END)
+            pos = self._write_records(f, f.tell(), items, index)
+            size = self._write_index(f, pos, index)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        return index, size
+
+    def _rewrite_pack(self, fn, items):
+        index = {}
+        tmp_fn = fn.with_name(fn.name + '.tmp')
+        with tmp_fn.open("wb") as f:
+            f.write(PACK_MAGIC)
+            pos = self._write_records(f, len(PACK_MAGIC), items, index)
+            size = self._write_index(f, pos, index)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_fn, fn)
+        if self.fsync:
+            fsync_directory(fn.parent)
+        return index, size
+
+    def _write_records(self, f, pos, items, index):
+        for item in items:
+            record = self._dump_item(item).encode('utf-8')
+            f.write(record)
+            index[item['id']] = (pos, len(record), index_entry(item))
+            pos += len(record)
+        return pos
+
+    def _write_index(self, f, pos, index):
+        data = json.dumps(index).encode('utf-8')
+        f.write(data)
+        f.write(INDEX_TRAILER.pack(INDEX_MAGIC, pos, len(data)))
+        return pos + len(data) + INDEX_TRAILER.size
@@ -0,0 +1,45 @@
+import importlib.util
+import pathlib
+import sys
+
+BUILTIN_PLUGIN_DIR = pathlib.Path(__file__).parent / 'builtin_plugins'
+# plugin modules are kept in sys.modules under this prefix, so that they
+# cannot shadow regular modules with the same name
+PLUGIN_MODULE_PREFIX = '_clikb_plugin.'
+
+class KanbanPluginRegistry:
+
+    def __init__(self, plugin_path):
+        # plugin_path is a colon separated string or a list of directories
+        if plugin_path is None:
+            plugin_dirs = []
+        elif isinstance(plugin_path, str):
+            plugin_dirs = [ p for p in plugin_path.split(':') if p ]
+        else:
+            plugin_dirs = list(plugin_path)
+        self.plugin_path = [ pathlib.Path(p) for p in plugin_dirs ] + [ BUILTIN_PLUGIN_DIR ]
+        self._locations = {}
+
+    def locate(self, plugin_name):
+        try:
+            return self._locations[plugin_name]
+        except KeyError:
+            pass
+        for plugin_dir in self.plugin_path:
+            fn = plugin_dir / (plugin_name + '.py')
+            if fn.is_file():
+                self._locations[plugin_name] = fn
+                return fn
+        raise ModuleNotFoundError(plugin_name)
+
+    def load_module(self, plugin_name):
+        fn = self.locate(plugin_name)
+        module_key = PLUGIN_MODULE_PREFIX + plugin_name
+        m = sys.modules.get(module_key)
+        if m is not None and m.__file__ == str(fn):
+            return m
+        spec = importlib.util.spec_from_file_location(plugin_name, fn)
+        m = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(m)
+        sys.modules[module_key] = m
+        return m
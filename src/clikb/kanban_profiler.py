@@ -0,0 +1,77 @@
+import contextlib
+import functools
+import json
+import pathlib
+import sys
+import time
+
+class KanbanProfiler:
+
+    def __init__(self, out_file=None):
+        # with an out_file ending in .json the timings are written to it as
+        # JSON, any other out_file gets cProfile statistics. Without one a
+        # summary is printed to stderr.
+        self.out_file = out_file
+        self.start = time.perf_counter()
+        # phase -> [ number of calls, total seconds ]
+        self.phases = {}
+        # (plugin module, hook) -> [ number of calls, total seconds ]
+        self.hook_timings = {}
+        self.counts = {}
+        self.cprofile = None
+        if out_file is not None and pathlib.Path(out_file).suffix != '.json':
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timing = self.phases.setdefault(name, [0, 0.0])
+            timing[0] += 1
+            timing[1] += time.perf_counter() - start
+
+    def wrap(self, obj, method_name, name):
+        # time every call of a method of obj as a phase
+        method = getattr(obj, method_name)
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            with self.phase(name):
+                return method(*args, **kwargs)
+        setattr(obj, method_name, timed)
+
+    def count(self, name, n):
+        self.counts[name] = n
+
+    def results(self):
+        return {
+            'total': time.perf_counter() - self.start,
+            'phases': [ { 'name': name, 'calls': calls, 'seconds': seconds }
+                for name, (calls, seconds) in self.phases.items() ],
+            'hooks': [ { 'plugin': plugin, 'hook': hook, 'calls': calls, 'seconds': seconds }
+                for (plugin, hook), (calls, seconds) in self.hook_timings.items() ],
+            'counts': self.counts,
+        }
+
+    def report(self):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.out_file)
+            return
+        results = self.results()
+        if self.out_file is not None:
+            with open(self.out_file, 'w') as f:
+                json.dump(results, f, indent=1)
+            return
+        # phases can contain each other and hooks, e.g. a save in add_save
+        lines = [ '%-32s %6s %12s' % ('phase', 'calls', 'total') ]
+        lines += [ '%-32s %6d %10.3fms' % (p['name'], p['calls'], p['seconds'] * 1000)
+                for p in results['phases'] ]
+        lines += [ '%-32s %6d %10.3fms' % ('%s.%s' % (h['plugin'], h['hook']), h['calls'], h['seconds'] * 1000)
+                for h in results['hooks'] ]
+        lines += [ '%-32s %6d' % (name, n) for name, n in results['counts'].items() ]
+        lines.append('%-32s %6s %10.3fms' % ('total', '', results['total'] * 1000))
+        sys.stderr.write(''.join( l + '\n' for l in lines ))
@@ -0,0 +1,107 @@
+import datetime
+import re
+import shlex
+
+CONDITION_RE = re.compile(r'^([^=!~<>]+)(~=|!=|<=|>=|=|<|>)(.*)$')
+RELATIVE_DAYS_RE = re.compile(r'^([+-]?\d+)d$')
+
+class Condition:
+
+    def __init__(self, key, op, value, date_format, today):
+        self.key = key
+        self.op = op
+        self.value = value
+        self.date_format = date_format
+        self.today = today
+
+    def matches(self, item):
+        # an empty value is the same as no value, like in the index
+        v = item.get(self.key)
+        if v is None:
+            return self.op == '!='
+        if self.op == '=':
+            return self._equals(v)
+        if self.op == '!=':
+            return not self._equals(v)
+        if self.op == '~=':
+            if isinstance(v, list):
+                return self._equals(v)
+            return self.value.lower() in str(v).lower()
+        return self._compare(v)
+
+    def _equals(self, v):
+        if isinstance(v, list):
+            return any( str(x) == self.value for x in v )
+        return str(v) == self.value
+
+    def _compare(self, v):
+        m = RELATIVE_DAYS_RE.match(self.value)
+        if m or isinstance(v, (datetime.date, datetime.datetime)):
+            v = self._to_date(v)
+            if m:
+                other = self.today + datetime.timedelta(days=int(m.group(1)))
+            else:
+                other = self._to_date(self.value)
+        else:
+            try:
+                v, other = float(v), float(self.value)
+            except (TypeError, ValueError):
+                v, other = str(v), self.value
+        if v is None or other is None:
+            return False
+        if self.op == '<':
+            return v < other
+        if self.op == '<=':
+            return v <= other
+        if self.op == '>':
+            return v > other
+        return v >= other
+
+    def _to_date(self, v):
+        if isinstance(v, datetime.datetime):
+            return v.date()
+        if isinstance(v, datetime.date):
+            return v
+        try:
+            return datetime.datetime.strptime(str(v), self.date_format).date()
+        except ValueError:
+            return None
+
+
+class KanbanQuery:
+
+    def __init__(self, conditions):
+        self.conditions = conditions
+
+    @classmethod
+    def parse(cls, expr, date_format='%Y-%m-%d', today=None):
+        # e.g. 'status=DOING tags~=bug due<7d'
+        if today is None:
+            today = datetime.date.today()
+        conditions = []
+        for c in shlex.split(expr):
+            m = CONDITION_RE.match(c)
+            if not m:
+                raise ValueError("invalid query condition: %s" % c)
+            conditions.append(Condition(m.group(1), m.group(2), m.group(3), date_format, today))
+        return cls(conditions)
+
+    def matches(self, item):
+        return all( c.matches(item) for c in self.conditions )
+
+    def candidate_ids(self, store):
+        # the ids of the items that can match, or None for all items
+        ids = None
+        for c in self.conditions:
+            found = store.query_index(c.key, c.op, c.value)
+            if found is not None:
+                ids = found if ids is None else ids & found
+        return ids
+
+    def select(self, store):
+        ids = self.candidate_ids(store)
+        if ids is None:
+            items = store.items()
+        else:
+            items = store.get_items(sorted(ids))
+        return [ i for i in items if self.matches(i) ]
@@ -0,0 +1,243 @@
+import bisect
+import datetime
+import json
+import os
+import pathlib
+from .base_kanban_store import EVENT_LOG_FILE, parse_event_date, read_cache_file, write_cache_file
+
+STATS_CACHE_FILE = '.kbstats'
+STATS_HISTORY_FILE = '.kbstats-history'
+STATS_CACHE_VERSION = 3
+PERCENTILES = (50, 85, 95)
+
+def percentiles(values, ps=PERCENTILES):
+    # nearest rank
+    values = sorted(values)
+    if values == []:
+        return { p: None for p in ps }
+    return { p: values[max(0, -(-p * len(values) // 100) - 1)] for p in ps }
+
+def parse_events(data):
+    # the records of complete log lines, all in one go unless there are torn
+    # appends in between
+    lines = data.decode('utf-8', 'replace').splitlines()
+    try:
+        return json.loads('[' + ','.join(lines) + ']')
+    except ValueError:
+        pass
+    events = []
+    for line in lines:
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            pass
+    return events
+
+def contribution(history, order, start_index, done_status):
+    # what one item adds to the aggregates: its lead and cycle time in
+    # days, the ISO week it was done in and the changes it makes to the
+    # number of items per status per day, as (day, status, change)
+    started = None
+    done = None
+    deltas = []
+    for i, (t, day, status) in enumerate(history):
+        if started is None and order.get(status, -1) >= start_index:
+            started = t
+        if done is None and status == done_status:
+            done = t
+            done_day = day
+        next_day = history[i+1][1] if i + 1 < len(history) else None
+        if status in order and day != next_day:
+            deltas.append((day, status, 1))
+            if next_day is not None:
+                deltas.append((next_day, status, -1))
+    if done is None:
+        return (None, None, None, deltas)
+    lead = (done - history[0][0]) / 86400
+    cycle = (done - started) / 86400 if started is not None and started <= done else None
+    year, week, weekday = datetime.date.fromordinal(done_day).isocalendar()
+    return (lead, cycle, '%d-W%02d' % (year, week), deltas)
+
+def add_count(counts, key, n):
+    n += counts.get(key, 0)
+    if n:
+        counts[key] = n
+    else:
+        del counts[key]
+
+
+class KanbanFlowStats:
+    # the status history of every item, read from the event log, and per
+    # report configuration the running aggregates over those histories. Both
+    # are cached in the store with the part of the log they were read from,
+    # so that only events logged since are read, and only the items they are
+    # about are counted again. The histories are in a cache of their own,
+    # which is only read when there are new events.
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        # id -> [ (timestamp, day ordinal, status) ] in time order, None
+        # until it is needed
+        self.histories = None
+        self.offset = 0
+        self.log_ino = None
+        # (statuses, start status, done status) -> aggregates, as builtin
+        # types only, so that the cache can be read safely
+        self.aggregates = {}
+        # the number of items with a history
+        self.num_items = 0
+        self.changed = False
+
+    def load(self):
+        try:
+            version, state = read_cache_file(self.path / STATS_CACHE_FILE)
+        except Exception:
+            return
+        if version == STATS_CACHE_VERSION:
+            self.log_ino, self.offset, self.num_items, self.aggregates = state
+
+    def _load_histories(self):
+        if self.histories is not None:
+            return
+        try:
+            version, (log_ino, offset, histories) = read_cache_file(self.path / STATS_HISTORY_FILE)
+        except Exception:
+            version = None
+        if version == STATS_CACHE_VERSION and (log_ino, offset) == (self.log_ino, self.offset):
+            self.histories = histories
+        else:
+            # not from the same part of the log, read it again
+            self._reset(self.log_ino)
+
+    def _reset(self, log_ino):
+        self.histories = {}
+        self.aggregates = {}
+        self.num_items = 0
+        self.offset = 0
+        self.log_ino = log_ino
+        self.changed = True
+
+    def save(self):
+        # the histories first, a crash in between leaves caches that do not
+        # match and are read again
+        try:
+            if self.histories is not None:
+                write_cache_file(self.path / STATS_HISTORY_FILE,
+                        (STATS_CACHE_VERSION, (self.log_ino, self.offset, self.histories)))
+            write_cache_file(self.path / STATS_CACHE_FILE,
+                    (STATS_CACHE_VERSION, (self.log_ino, self.offset, self.num_items, self.aggregates)))
+        except OSError:
+            # a read-only store gets its stats, just not cached
+            pass
+
+    def update(self):
+        # read the events that were logged since the cache was written, in
+        # one pass, and count the items they are about again. Returns the
+        # number of new events.
+        try:
+            f = (self.path / EVENT_LOG_FILE).open("rb")
+        except FileNotFoundError:
+            return 0
+        events = []
+        with f:
+            st = os.fstat(f.fileno())
+            if st.st_ino != self.log_ino or st.st_size < self.offset:
+                # a different log, start again
+                self._reset(st.st_ino)
+            elif st.st_size == self.offset:
+                return 0
+            else:
+                self._load_histories()
+            f.seek(self.offset)
+            data = f.read()
+        # the last line can still be being appended
+        data = data[:data.rfind(b'\n') + 1]
+        if data:
+            self.offset += len(data)
+            self.changed = True
+        for e in parse_events(data):
+            date = parse_event_date(e['date'])
+            if isinstance(date, datetime.datetime):
+                events.append((e['id'], (date.timestamp(), date.toordinal(), e['status'])))
+        touched = set( idx for idx, event in events )
+        for key, aggregate in self.aggregates.items():
+            self._count(key, aggregate, touched, -1)
+        for idx, event in events:
+            history = self.histories.get(idx)
+            if history is None:
+                history = self.histories[idx] = []
+                self.num_items += 1
+            # migrated history can be logged after newer events
+            bisect.insort(history, event)
+        for key, aggregate in self.aggregates.items():
+            self._count(key, aggregate, touched, 1)
+        return len(events)
+
+    def _count(self, key, aggregate, ids, sign):
+        # add what the histories of the items contribute to the aggregate,
+        # or take it away
+        statuses, start_status, done_status = key
+        order = { s: i for i, s in enumerate(statuses) }
+        start_index = order.get(start_status, 0)
+        for idx in ids:
+            history = self.histories.get(idx)
+            if history:
+                self._apply(aggregate, contribution(history, order, start_index, done_status), sign)
+
+    def _apply(self, aggregate, c, sign):
+        lead, cycle, week, deltas = c
+        for times, t in ((aggregate['lead_times'], lead), (aggregate['cycle_times'], cycle)):
+            if t is None:
+                continue
+            if sign > 0:
+                bisect.insort(times, t)
+            else:
+                del times[bisect.bisect_left(times, t)]
+        if week is not None:
+            add_count(aggregate['throughput'], week, sign)
+        days = aggregate['deltas']
+        for day, status, change in deltas:
+            counts = days.setdefault(day, {})
+            add_count(counts, status, sign * change)
+            if counts == {}:
+                del days[day]
+
+    def _aggregate(self, key):
+        try:
+            return self.aggregates[key]
+        except KeyError:
+            pass
+        if self.histories is None:
+            self._load_histories()
+            # reads the log again if the histories did not match
+            self.update()
+        aggregate = { 'lead_times': [], 'cycle_times': [], 'throughput': {}, 'deltas': {} }
+        self._count(key, aggregate, self.histories, 1)
+        self.aggregates[key] = aggregate
+        self.changed = True
+        return aggregate
+
+    def report(self, statuses, start_status, done_status, today=None):
+        # lead time from the first event of an item, and cycle time from
+        # when it first reached start_status or a later status, until it
+        # first reached done_status. Throughput per ISO week, and per day
+        # the number of items in each status, for a cumulative flow diagram.
+        if today is None:
+            today = datetime.date.today()
+        aggregate = self._aggregate((tuple(statuses), start_status, done_status))
+        deltas = aggregate['deltas']
+        cfd = []
+        if deltas:
+            counts = dict.fromkeys(statuses, 0)
+            for day in range(min(deltas), today.toordinal() + 1):
+                for status, change in deltas.get(day, {}).items():
+                    counts[status] += change
+                cfd.append([ datetime.date.fromordinal(day).isoformat() ] + [ counts[s] for s in statuses ])
+        return {
+            'items': self.num_items,
+            'done': len(aggregate['lead_times']),
+            'lead_time_days': percentiles(aggregate['lead_times']),
+            'cycle_time_days': percentiles(aggregate['cycle_times']),
+            'throughput': dict(sorted(aggregate['throughput'].items())),
+            'cfd': { 'statuses': statuses, 'days': cfd },
+        }
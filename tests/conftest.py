@@ -0,0 +1,19 @@
+import pathlib
+import pytest
+
+from clikb.kanban_directory_store import KanbanDirectoryStore
+
+@pytest.fixture
+def test_file():
+    def get(fn):
+        return pathlib.Path(__file__).parent / 'data' / fn
+    return get
+
+# test_store1 saved in a temporary directory, for tests that change it
+@pytest.fixture
+def store_copy(test_file, tmpdir):
+    path = pathlib.Path(tmpdir) / 'test_store1'
+    k = KanbanDirectoryStore()
+    k.load(test_file('test_store1'))
+    k.save(path)
+    return path
@@ -1,12 +1,9 @@
 import pytest
 import pathlib
-from clikb.cli import KanbanApp
-
-@pytest.fixture
-def test_file():
-    def get(fn):
-        return pathlib.Path(__file__).parent / 'data' / fn
-    return get
+from click.testing import CliRunner
+from clikb.cli import KanbanApp, app
+from clikb.kanban_directory_store import KanbanDirectoryStore
+from clikb.kanban_packed_store import PACK_FILE
 
 class MockContext:
     params = {}
@@ -20,11 +17,152 @@ def app_context():
     return make
 
 
-def test_active_plugins(test_file, app_context):
-    store_path = test_file('test_store1')
+def test_active_plugins(store_copy, test_file, app_context):
+    store_path = store_copy
     plugin_dir = test_file('test_plugin_dir')
     a = KanbanApp(app_context(kanban_store=store_path, kanban_plugin_path=[plugin_dir]))
     a.initialize()
     # assert that plugins are loaded, main and test_plugin
     assert [p.__module__ for p in a.plugins() ] == [ 'testplugin', 'main' ]
 
+
+# import a directory store into a packed store and export it again
+def test_import_export(test_file, tmpdir):
+    packed = pathlib.Path(tmpdir) / 'packed'
+    exported = pathlib.Path(tmpdir) / 'exported'
+    runner = CliRunner()
+    r = runner.invoke(app, ['-d', str(packed), 'import', str(test_file('test_store1'))])
+    assert r.exit_code == 0
+    assert (packed / PACK_FILE).exists()
+    r = runner.invoke(app, ['-d', str(packed), 'export', str(exported)])
+    assert r.exit_code == 0
+    assert sorted(fn.name for fn in exported.iterdir() if not fn.name.startswith('.')) == [ '00000.kbi', '00002.kbi', '00003.kbi', 'board.kbb' ]
+
+# apply a batch of edits and adds with one load and one save
+def test_batch(store_copy, test_file):
+    path = store_copy
+    batch = '\n'.join([
+        '0 DOING',
+        'add "a new item"',
+        '# a comment',
+        '{"id": 2, "field": 14}',
+        '9 DONE',
+        '{"description": "json item", "tags": ["a"]}',
+    ])
+    r = CliRunner().invoke(app, ['-d', str(path), '-P', str(test_file('test_plugin_dir')), 'batch'], input=batch)
+    assert r.exit_code == 1
+    assert r.output.splitlines() == [
+        '1\tedited 0', '2\tadded 4', '4\tedited 2',
+        '5\terror: No such item: 9', '6\tadded 5' ]
+    k = KanbanDirectoryStore()
+    k.load(path)
+    assert [x['id'] for x in k.items()] == [0,2,3,4,5]
+    assert k.get_item(0)['status'] == 'DOING'
+    assert k.get_item(2)['field'] == 14
+    assert k.get_item(4)['description'] == "a new item"
+    assert k.get_item(5)['tags'] == ['a']
+
+# plugins are located once and their modules are reused
+def test_plugin_registry(test_file):
+    from clikb.kanban_plugin_registry import KanbanPluginRegistry
+    r = KanbanPluginRegistry(str(test_file('test_plugin_dir')))
+    m = r.load_module('testplugin')
+    assert r.load_module('testplugin') is m
+    assert KanbanPluginRegistry([test_file('test_plugin_dir')]).load_module('testplugin') is m
+    assert r.load_module('main').__name__ == 'main'
+    with pytest.raises(ModuleNotFoundError):
+        r.load_module('nosuchplugin')
+
+# only hooks that plugins override are dispatched
+def test_hook_dispatch(store_copy, test_file, app_context):
+    store_path = store_copy
+    plugin_dir = test_file('test_plugin_dir')
+    a = KanbanApp(app_context(kanban_store=store_path, kanban_plugin_path=[plugin_dir]))
+    a.initialize()
+    assert [p.__module__ for p in a.dispatcher.hook_plugins('show', 'pre') ] == [ 'testplugin' ]
+    assert [p.__module__ for p in a.dispatcher.hook_plugins('show', 'do') ] == [ 'main' ]
+    assert a.dispatcher.hook_plugins('show', 'post') == []
+
+# --profile-file writes the timings of the phases and hooks as JSON
+def test_profile(store_copy, test_file, tmpdir):
+    import json
+    trace = pathlib.Path(tmpdir) / 'profile.json'
+    r = CliRunner().invoke(app, ['-d', str(store_copy), '-P', str(test_file('test_plugin_dir')),
+        '--profile-file', str(trace), 'list'])
+    assert r.exit_code == 0
+    with trace.open() as f:
+        results = json.load(f)
+    assert [ p['name'] for p in results['phases'] ] == [ 'store load', 'plugin import testplugin', 'plugin import main', 'store parse' ]
+    assert [ (h['plugin'], h['hook']) for h in results['hooks'] ] == [ ('main', 'list_do') ]
+    assert results['counts'] == { 'items': 3, 'items parsed': 3 }
+
+# the shell runs commands with one app and carries on after errors
+def test_shell(store_copy, test_file):
+    path = store_copy
+    commands = '\n'.join([ 'add one', '9 DONE', '4 DOING', 'list -q status=DOING', 'shell', 'quit', 'list' ])
+    r = CliRunner().invoke(app, ['-d', str(path), '-P', str(test_file('test_plugin_dir')), 'shell'], input=commands)
+    assert r.exit_code == 0
+    assert r.output.replace('clikb> ', '').splitlines() == [
+        'Error: No such item: 9', '4\tone', 'Error: Already in the shell.' ]
+
+# a broken pipe ends the command, not the shell
+def test_shell_broken_pipe(store_copy, test_file, monkeypatch):
+    path = store_copy
+    def items(self):
+        raise BrokenPipeError()
+    monkeypatch.setattr(KanbanApp, 'items', items)
+    commands = '\n'.join([ 'list', 'add one', 'show' ])
+    r = CliRunner().invoke(app, ['-d', str(path), '-P', str(test_file('test_plugin_dir')), 'shell'], input=commands)
+    assert r.exit_code == 0
+    k = KanbanDirectoryStore()
+    k.load(path)
+    assert k.get_item(4)['description'] == 'one'
+
+# the status_change plugin logs the status of added items and status changes
+def test_status_change_plugin(store_copy):
+    path = store_copy
+    k = KanbanDirectoryStore()
+    k.load(path)
+    k.get_board()['plugins'] = [ 'status_change' ]
+    k.save()
+    plugins = pathlib.Path(__file__).parent.parent / 'kanban_plugins'
+    runner = CliRunner()
+    for args in [ [ 'add', 'status=READY' ], [ '4', 'DOING' ], [ '4', 'DOING' ], [ '0', 'DONE' ] ]:
+        r = runner.invoke(app, ['-d', str(path), '-P', str(plugins)] + args)
+        assert r.exit_code == 0
+    k = KanbanDirectoryStore()
+    k.load(path)
+    assert [ (e['id'], e['status']) for e in k.status_history() ] == [ (4, 'READY'), (4, 'DOING'), (0, 'DONE') ]
+    assert '_status_changes' not in k.get_item(4)
+
+# an export in the shell leaves the plugins with the store the shell edits
+def test_shell_export(store_copy, tmpdir):
+    path = store_copy
+    k = KanbanDirectoryStore()
+    k.load(path)
+    k.get_board()['plugins'] = [ 'status_change' ]
+    k.save()
+    plugins = pathlib.Path(__file__).parent.parent / 'kanban_plugins'
+    dest = pathlib.Path(tmpdir) / 'exported'
+    commands = '\n'.join([ 'export %s' % dest, 'add status=READY', '0 DONE' ])
+    r = CliRunner().invoke(app, ['-d', str(path), '-P', str(plugins), 'shell'], input=commands)
+    assert r.exit_code == 0
+    assert (dest / 'board.kbb').exists()
+    k = KanbanDirectoryStore()
+    k.load(path)
+    assert [ (e['id'], e['status']) for e in k.status_history() ] == [ (4, 'READY'), (0, 'DONE') ]
+
+# list writes a JSON record per item, show needs no field format for it
+def test_jsonl_output(store_copy, test_file, tmpdir):
+    import json
+    out = pathlib.Path(tmpdir) / 'items.jsonl'
+    args = ['-d', str(store_copy), '-P', str(test_file('test_plugin_dir'))]
+    r = CliRunner().invoke(app, args + ['list', '--out-format', 'jsonl', '-o', str(out)])
+    assert r.exit_code == 0
+    with out.open() as f:
+        assert [ json.loads(l) for l in f ] == [ { 'id': 0, 'descr': 'a small test item' },
+            { 'id': 2, 'descr': 'another item', 'field': 12 }, { 'id': 3, 'descr': 'another item', 'field': 12 } ]
+    r = CliRunner().invoke(app, args + ['show', '--out-format', 'jsonl'])
+    assert (r.exit_code, r.output) == (0, '')
+    r = CliRunner().invoke(app, args + ['show', '--out-format', 'jsonl', '--field-format', 'wide'])
+    assert r.exit_code == 2
@@ -0,0 +1,112 @@
+import datetime
+import pathlib
+import pytest
+from click.testing import CliRunner
+
+from clikb.cli import app
+from clikb.kanban_archive import KanbanArchive, ARCHIVE_FILE, archive_items, archive_policy_items
+from clikb.kanban_directory_store import KanbanDirectoryStore
+from clikb.kanban_packed_store import KanbanPackedStore
+
+def make_store(store_class, path, event_log=False):
+    k = store_class()
+    k.get_board()['show_statuses'] = [ 'READY', 'DOING', 'DONE' ]
+    k.get_board()['plugins'] = []
+    k.get_board()['archive_policy'] = { 'status': 'DONE', 'days': 30 }
+    for status, days_ago in [ ('DONE', 40), ('DONE', 10), ('READY', 50), ('DONE', 31) ]:
+        changed = datetime.datetime.now() - datetime.timedelta(days=days_ago)
+        item = { 'description': '%s %d' % (status, days_ago), 'status': status }
+        if event_log:
+            k.log_status_change(item, status, changed)
+        else:
+            item['_status_changes'] = [ { 'status': status, 'date': changed } ]
+        k.add_item(item)
+    k.save(path)
+    k = store_class()
+    k.load(path)
+    return k
+
+# appends are read back in id order, a torn append is skipped
+def test_archive_file(tmpdir):
+    a = KanbanArchive(tmpdir)
+    assert a.items() == []
+    a.append([ { 'id': 3, 'description': 'c' } ])
+    a.append([ { 'id': 1, 'description': 'a' }, { 'id': 3, 'description': 'c again' } ])
+    size = a.fn.stat().st_size
+    a.append([ { 'id': 2, 'description': 'b' } ])
+    with a.fn.open('r+b') as f:
+        f.truncate(size + 10)
+    assert a.items() == [ { 'id': 1, 'description': 'a' }, { 'id': 3, 'description': 'c again' } ]
+
+# the policy selects items that are DONE for long enough
+@pytest.mark.parametrize('store_class', [ KanbanDirectoryStore, KanbanPackedStore ])
+@pytest.mark.parametrize('event_log', [ False, True ])
+def test_archive_items(tmpdir, store_class, event_log):
+    path = pathlib.Path(tmpdir) / 'store'
+    k = make_store(store_class, path, event_log)
+    ids = [ i['id'] for i in archive_policy_items(k, k.get_board()['archive_policy']) ]
+    assert ids == [ 0, 3 ]
+    assert archive_items(k, ids) == 2
+    k = store_class()
+    k.load(path)
+    assert [ i['id'] for i in k.items() ] == [ 1, 2 ]
+    assert [ i['id'] for i in KanbanArchive(path).items() ] == [ 0, 3 ]
+    # the ids of archived items are not used again
+    k.add_item({ 'description': 'new' })
+    assert k.max_idx == 4
+
+# the latest change counts, also when older history is migrated later
+def test_archive_migrated_history(tmpdir):
+    path = pathlib.Path(tmpdir) / 'store'
+    k = make_store(KanbanDirectoryStore, path)
+    item = k.get_item(0).copy()
+    k.log_status_change(item, 'DOING')
+    k.log_status_change(item, 'DONE')
+    k.save()
+    assert k.migrate_status_changes() == 4
+    k.save()
+    k = KanbanDirectoryStore()
+    k.load(path)
+    assert [ (e['id'], e['status']) for e in k.status_history(0) ] == [ (0, 'DOING'), (0, 'DONE'), (0, 'DONE') ]
+    ids = [ i['id'] for i in archive_policy_items(k, k.get_board()['archive_policy']) ]
+    assert ids == [ 3 ]
+
+# archive with the policy, then list the archived items
+def test_archive_command(tmpdir):
+    path = pathlib.Path(tmpdir) / 'store'
+    make_store(KanbanDirectoryStore, path)
+    runner = CliRunner()
+    r = runner.invoke(app, [ '-d', str(path), 'archive' ])
+    assert r.output == 'archived 2 items\n'
+    r = runner.invoke(app, [ '-d', str(path), 'list' ])
+    assert r.output == '1\tDONE 10\n2\tREADY 50\n'
+    r = runner.invoke(app, [ '-d', str(path), 'list', '--archived', '-q', 'description~=40' ])
+    assert r.output == '0\tDONE 40\n'
+    r = runner.invoke(app, [ '-d', str(path), 'archive', '7' ])
+    assert r.exit_code == 2
+    # a missing id archives nothing, the same id twice archives it once
+    r = runner.invoke(app, [ '-d', str(path), 'archive', '1', '7' ])
+    assert r.exit_code == 2
+    assert [ i['id'] for i in KanbanArchive(path).items() ] == [ 0, 3 ]
+    r = runner.invoke(app, [ '-d', str(path), 'archive', '1', '1' ])
+    assert r.output == 'archived 1 items\n'
+    r = runner.invoke(app, [ '-d', str(path), 'list', '--archived' ])
+    assert r.output == '0\tDONE 40\n1\tDONE 10\n3\tDONE 31\n'
+    assert sorted(fn.name for fn in path.iterdir() if not fn.name.startswith('.')) == [ '00002.kbi', ARCHIVE_FILE, 'board.kbb' ]
+    k = KanbanDirectoryStore()
+    k.load(path)
+    assert k.get_board()['max_archived_id'] == 3
+
+# a policy status can have spaces
+def test_archive_policy_status_with_space(tmpdir):
+    path = pathlib.Path(tmpdir) / 'store'
+    k = make_store(KanbanDirectoryStore, path)
+    k.get_board()['archive_policy'] = { 'status': 'IN PROGRESS', 'days': 30 }
+    item = k.get_item(2)
+    item['status'] = 'IN PROGRESS'
+    item['_status_changes'] = [ { 'status': 'IN PROGRESS', 'date': datetime.datetime.now() - datetime.timedelta(days=40) } ]
+    k.set_item(2, item)
+    k.save()
+    r = CliRunner().invoke(app, [ '-d', str(path), 'archive' ])
+    assert r.output == 'archived 1 items\n'
+    assert [ i['id'] for i in KanbanArchive(path).items() ] == [ 2 ]
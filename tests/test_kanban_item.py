@@ -0,0 +1,42 @@
+import pickle
+import pytest
+
+from clikb.kanban_item import CompactItem
+from clikb.kanban_directory_store import KanbanDirectoryStore
+
+# a compact item behaves like the dict it was made from
+def test_compact_item():
+    d = { 'description': 'an item', 'status': 'READY', 'tags': [ 'a', 'b' ],
+        '_status_changes': [ { 'status': 'READY', 'date': 'today' } ] }
+    c = CompactItem(d)
+    assert c == d and d == c
+    assert c['status'] == 'READY' and c.get('due') is None and 'tags' in c
+    assert '%(description)s' % c == 'an item'
+    c['due'] = '2026-01-01'
+    del c['status']
+    assert list(c) == [ 'description', 'tags', '_status_changes', 'due' ]
+    with pytest.raises(KeyError):
+        c['status']
+    assert type(c.copy()) is dict and type(c.copy()['_status_changes'][0]) is dict
+    assert pickle.loads(pickle.dumps(c)) == c
+    # items with the same keys share them
+    assert CompactItem(d)._layout is CompactItem(dict(d))._layout
+
+# a board can ask for compact items, which are saved like dicts
+def test_load_compact_items(store_copy):
+    path = store_copy
+    k = KanbanDirectoryStore()
+    k.load(path)
+    k.get_board()['compact_items'] = True
+    k.save()
+    for lazy in (False, True):
+        c = KanbanDirectoryStore(lazy=lazy)
+        c.load(path)
+        assert [ type(x) for x in c.items() ] == [ CompactItem ] * 3
+        assert c.items() == k.items()
+    c.edit_item(2, {'field': 13})
+    c.save()
+    c = KanbanDirectoryStore()
+    c.load(path)
+    assert c.get_item(2)['field'] == 13
+    assert c.items()[0] == k.items()[0]
@@ -0,0 +1,140 @@
+import pathlib
+import pytest
+
+from clikb.kanban_directory_store import KanbanDirectoryStore
+from clikb.kanban_packed_store import KanbanPackedStore, PACK_FILE
+from clikb.base_kanban_store import KanbanStoreConflict
+
+def make_packed_store(test_file, path):
+    d = KanbanDirectoryStore()
+    d.load(test_file("test_store1"))
+    k = KanbanPackedStore()
+    k.copy_from(d)
+    k.save(path)
+    return k
+
+# load from a store without pack file
+def test_load_empty_packed_store(test_file):
+    k = KanbanPackedStore()
+    k.load(test_file("test_store_empty"))
+    assert k.items() == []
+
+# convert a directory store, then load
+def test_packed_store_save_then_load(test_file, tmpdir):
+    path = pathlib.Path(tmpdir) / 'packed'
+    make_packed_store(test_file, path)
+    assert sorted(fn.name for fn in path.iterdir() if not fn.name.startswith('.')) == [ 'board.kbb', PACK_FILE ]
+    k = KanbanPackedStore()
+    k.load(path)
+    assert [x['id'] for x in k.items()] == [0,2,3]
+    assert k.get_item(0) == {'descr': "a small test item", 'id': 0}
+    assert k.get_board()['plugins'] == ['testplugin']
+
+# edits are appended, the last record of an item wins
+def test_packed_store_append(test_file, tmpdir):
+    path = pathlib.Path(tmpdir) / 'packed'
+    make_packed_store(test_file, path)
+    k = KanbanPackedStore()
+    k.load(path)
+    size = (path / PACK_FILE).stat().st_size
+    k.edit_item(2, {'field': 13})
+    k.add_item({'descr': "a new item"})
+    assert k.save() == 2
+    assert (path / PACK_FILE).stat().st_size > size
+    k = KanbanPackedStore()
+    k.load(path)
+    assert [x['id'] for x in k.items()] == [0,2,3,4]
+    assert k.get_item(2)['field'] == 13
+    assert k.get_item(4)['descr'] == "a new item"
+
+# appends by another writer are kept, conflicting edits are refused
+def test_packed_store_concurrent_writers(test_file, tmpdir):
+    path = pathlib.Path(tmpdir) / 'packed'
+    make_packed_store(test_file, path)
+    k1 = KanbanPackedStore()
+    k1.load(path)
+    k2 = KanbanPackedStore()
+    k2.load(path)
+    k1.edit_item(2, {'descr': "first"})
+    k1.add_item({'descr': "added first"})
+    k1.save()
+    k2.add_item({'descr': "added second"})
+    k2.edit_item(3, {'descr': "second"})
+    assert k2.save() == 2
+    assert k2.get_item(2)['descr'] == "first"
+    k2.edit_item(2, {'descr': "second"})
+    k2.save()
+    k1.edit_item(2, {'descr': "again"})
+    with pytest.raises(KanbanStoreConflict):
+        k1.save()
+    k = KanbanPackedStore()
+    k.load(path)
+    assert [ (x['id'], x['descr']) for x in k.items() ][1:] == [ (2, "second"), (3, "second"), (4, "added first"), (5, "added second") ]
+
+# stale records are dropped when the pack grows too large
+def test_packed_store_compaction(test_file, tmpdir):
+    path = pathlib.Path(tmpdir) / 'packed'
+    make_packed_store(test_file, path)
+    k = KanbanPackedStore()
+    k.load(path)
+    for i in range(2000):
+        k.edit_item(0, {'descr': "edit %d" % i})
+        k.save()
+    assert (path / PACK_FILE).stat().st_size < 70000
+    k = KanbanPackedStore()
+    k.load(path)
+    assert k.get_item(0)['descr'] == "edit 1999"
+    assert [x['id'] for x in k.items()] == [0,2,3]
+
+# lazy load reads the index and only the records that are accessed
+def test_packed_store_lazy_load(test_file, tmpdir):
+    path = pathlib.Path(tmpdir) / 'packed'
+    make_packed_store(test_file, path)
+    k = KanbanPackedStore(lazy=True)
+    k.load(path)
+    assert k.max_idx == 3
+    assert k.get_item(2)['descr'] == "another item"
+    k.edit_item(3, {'field': 13})
+    assert k.save() == 1
+    k = KanbanPackedStore(lazy=True)
+    k.load(path)
+    assert [x['id'] for x in k.items()] == [0,2,3]
+    assert k.get_item(3)['field'] == 13
+
+# a lazy reader reads the pack it loaded, also after another writer compacted it
+def test_packed_store_lazy_load_compacted(test_file, tmpdir):
+    path = pathlib.Path(tmpdir) / 'packed'
+    make_packed_store(test_file, path)
+    reader = KanbanPackedStore(lazy=True)
+    reader.load(path)
+    k = KanbanPackedStore()
+    k.load(path)
+    ino = (path / PACK_FILE).stat().st_ino
+    for i in range(200):
+        k.edit_item(0, {'descr': "edit %d %s" % (i, 'x' * 1000)})
+        k.save()
+    assert (path / PACK_FILE).stat().st_ino != ino
+    assert reader.get_item(3) == {'descr': "another item", 'field': 12, 'id': 3}
+    assert reader.get_item(0) == {'descr': "a small test item", 'id': 0}
+    reader.refresh()
+    assert reader.get_item(0)['descr'].startswith("edit 199 ")
+    assert reader.get_item(2) == {'descr': "another item", 'field': 12, 'id': 2}
+
+# an interrupted append falls back to the last complete index
+def test_packed_store_torn_append(test_file, tmpdir):
+    path = pathlib.Path(tmpdir) / 'packed'
+    make_packed_store(test_file, path)
+    k = KanbanPackedStore()
+    k.load(path)
+    k.edit_item(0, {'descr': "edited"})
+    k.save()
+    with (path / PACK_FILE).open("ab") as f:
+        f.write(b"descr: half a rec")
+    k = KanbanPackedStore()
+    k.load(path)
+    assert k.get_item(0)['descr'] == "edited"
+    k.edit_item(2, {'descr': "edited"})
+    k.save()
+    k = KanbanPackedStore()
+    k.load(path)
+    assert [x['descr'] for x in k.items()] == [ "edited", "edited", "another item" ]
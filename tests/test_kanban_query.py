@@ -0,0 +1,74 @@
+import datetime
+import pathlib
+import pytest
+
+from clikb.kanban_directory_store import KanbanDirectoryStore, INDEX_FILE
+from clikb.kanban_packed_store import KanbanPackedStore
+from clikb.kanban_query import KanbanQuery
+
+TODAY = datetime.date(2022, 3, 1)
+
+def make_store(k):
+    for d in [
+            {'description': 'fix bug', 'status': 'DOING', 'tags': ['bug'], 'due': '2022-03-03'},
+            {'description': 'write docs', 'status': 'READY', 'tags': ['docs'], 'due': '2022-04-01'},
+            {'description': 'another bug', 'status': 'READY', 'tags': ['bug', 'ui']},
+            {'description': 'old', 'status': 'DONE', 'tags': 'bug, later', 'estimate': 3},
+        ]:
+        k.add_item(d)
+    return k
+
+def select(k, expr):
+    return [ i['id'] for i in KanbanQuery.parse(expr, today=TODAY).select(k) ]
+
+# conditions on values, lists, numbers and dates
+def test_query():
+    k = make_store(KanbanDirectoryStore())
+    assert select(k, 'status=READY') == [1,2]
+    assert select(k, 'status!=READY') == [0,3]
+    assert select(k, 'tags~=bug') == [0,2,3]
+    assert select(k, 'tags=bug') == [0,2]
+    assert select(k, 'status=READY tags~=bug') == [2]
+    assert select(k, 'description~=BUG') == [0,2]
+    assert select(k, 'due<7d') == [0]
+    assert select(k, 'due>=2022-03-03') == [0,1]
+    assert select(k, 'estimate>2') == [3]
+    assert select(k, '"description=write docs"') == [1]
+    with pytest.raises(ValueError):
+        KanbanQuery.parse('status')
+
+# the index narrows down the items that are checked
+def test_query_index():
+    k = make_store(KanbanDirectoryStore())
+    q = KanbanQuery.parse('status=READY tags~=bug')
+    assert q.candidate_ids(k) == {2}
+    k.edit_item(1, {'tags': ['bug']})
+    assert q.candidate_ids(k) == {1,2}
+    assert KanbanQuery.parse('due<7d').candidate_ids(k) is None
+
+# queries find the same items with and without the index
+def test_query_index_same_as_scan():
+    k = make_store(KanbanDirectoryStore())
+    k.add_item({'description': 'empty', 'status': None, 'tags': None})
+    k.add_item({'description': 'numbers', 'status': 3, 'tags': [ 1, 'None' ]})
+    for expr in [ 'status=READY', 'status~=on', 'status=None', 'status~=3', 'status=3', 'tags=None',
+            'tags~=on', 'tags~=None', 'tags=bug', 'tags~=bug', 'tags=1', 'tags~=ui' ]:
+        q = KanbanQuery.parse(expr, today=TODAY)
+        assert q.select(k) == [ i for i in k.items() if q.matches(i) ], expr
+    assert select(k, 'status=None') == []
+    assert select(k, 'tags=None') == [5]
+    assert select(k, 'status!=READY') == [0,3,4,5]
+
+# lazy stores only parse the items that can match
+@pytest.mark.parametrize('store_class', [ KanbanDirectoryStore, KanbanPackedStore ])
+def test_query_lazy_store(tmpdir, store_class):
+    path = pathlib.Path(tmpdir) / 'store'
+    make_store(store_class()).save(path)
+    # the first query on a directory store writes its index
+    for i in range(2):
+        k = store_class(lazy=True)
+        k.load(path)
+        assert select(k, 'status=READY tags~=bug') == [2]
+    assert [ idx for idx, item in k._items.items() if item is not None ] == [2]
+    if store_class is KanbanDirectoryStore:
+        assert (path / INDEX_FILE).exists()
@@ -0,0 +1,144 @@
+import io
+import itertools
+import pytest
+
+from clikb.kanban_directory_store import KanbanDirectoryStore
+from clikb.kanban_board_renderer import *
+
+class MockApp:
+    def items(self):
+        return self.kanban_store.items()
+
+@pytest.fixture
+def kanban_app():
+    k = KanbanDirectoryStore()
+    k.get_board()['show_statuses'] = [ 'READY', 'DOING', 'DONE' ]
+    for descr, status in [ ('a', 'READY'), ('b', 'DONE'), ('c', 'READY'), ('d', 'BLOCKED') ]:
+        k.add_item({'description': descr, 'status': status})
+    a = MockApp()
+    a.kanban_store = k
+    return a
+
+# items are grouped per status column, in store order
+def test_group_by_status(kanban_app):
+    r = KanbanBoardBaseRenderer(kanban_app)
+    rows = [ [ x and x['description'] for x in row ] for row in r.group_by_status() ]
+    assert rows == [ [ 'a', None, 'b' ], [ 'c', None, None ] ]
+
+# render a board for the console
+def test_console_renderer(kanban_app, monkeypatch):
+    monkeypatch.setenv('COLUMNS', '30')
+    out = io.StringIO()
+    r = KanbanBoardConsoleRenderer(kanban_app, [ {'text': '%(id)d %(description)s'} ], out)
+    r.render(r.group_by_status())
+    assert out.getvalue().splitlines() == [
+        '│ READY   │ DOING   │ DONE    ',
+        '┕━━━━━━━  ┕━━━━━━━  ┕━━━━━━   ',
+        '0 a                 1 b       ',
+        '2 c                           ',
+    ]
+
+# wide characters take two columns
+def test_console_renderer_wide(kanban_app, monkeypatch):
+    wcwidth = pytest.importorskip('wcwidth')
+    monkeypatch.setenv('COLUMNS', '30')
+    kanban_app.kanban_store.edit_item(1, {'description': '漢字漢字漢字'})
+    out = io.StringIO()
+    r = KanbanBoardConsoleRenderer(kanban_app, [ {'text': '%(id)d %(description)s'} ], out)
+    r.render(r.group_by_status())
+    lines = out.getvalue().splitlines()
+    assert lines[2].startswith('0 a                 1 漢字')
+    assert lines[3] == '2 c                           '
+    assert all( wcwidth.wcswidth(l) <= 30 for l in lines )
+
+# render a board as CSV
+def test_csv_renderer(kanban_app):
+    out = io.StringIO()
+    r = KanbanBoardCSVRenderer(kanban_app, '%(id)d %(description)s', out)
+    r.render(r.group_by_status())
+    assert out.getvalue().splitlines() == [ 'READY,DOING,DONE', '0 a,,1 b', '2 c,,' ]
+
+# computed fields with dependencies are cached across renders
+def test_computed_field_cache(kanban_app):
+    calls = []
+    def upper(d):
+        calls.append(d['id'])
+        return d['description'].upper()
+    for i in range(2):
+        out = io.StringIO()
+        r = KanbanBoardCSVRenderer(kanban_app, '%(id)d', out)
+        r.add_computed_field('upper', upper, depends=['description'])
+        assert [ r.computed_fields['upper'](item) for item in kanban_app.kanban_store.items() ] == [ 'A', 'B', 'C', 'D' ]
+    assert calls == [ 0, 1, 2, 3 ]
+
+# templates know their keys, only the computed fields they need are resolved
+def test_field_template_keys(kanban_app):
+    t = FieldTemplate('%(id)3d %%(x)s %(description)s %(id)d')
+    assert t.keys == [ 'id', 'description' ]
+    calls = []
+    def field(key, depends):
+        def compute(d):
+            calls.append(key)
+            return key
+        return key, compute, depends
+    r = KanbanBoardCSVRenderer(kanban_app, '%(b)s %(c)s %(missing)s', io.StringIO())
+    r.add_computed_field(*field('a', None))
+    r.add_computed_field(*field('unused', None))
+    r.add_computed_field(*field('b', ['a']))
+    r.add_computed_field(*field('c', None))
+    r.add_computed_field(*field('d', None))
+    t, = r.compile_templates([ r.fieldfmt ])
+    assert t.render(r.resolve(kanban_app.kanban_store.get_item(0))) == 'b c ?'
+    assert calls == [ 'a', 'unused', 'b', 'c' ]
+
+# rows are written as soon as they are rendered
+def test_console_renderer_streams(kanban_app, monkeypatch):
+    monkeypatch.setenv('COLUMNS', '30')
+    out = io.StringIO()
+    r = KanbanBoardConsoleRenderer(kanban_app, [ {'text': '%(id)d %(description)s'} ], out)
+    def rows():
+        yield from itertools.islice(r.group_by_status(), 1)
+        assert out.getvalue().splitlines()[2] == '0 a                 1 b       '
+    r.render(rows())
+    assert len(out.getvalue().splitlines()) == 3
+
+# computed columns are computed for a batch of rows at once
+def test_computed_columns(kanban_app):
+    calls = []
+    def columns(items):
+        calls.append([ i['id'] for i in items ])
+        return [ (i['description'] * 2, i['id'] * 2) for i in items ]
+    out = io.StringIO()
+    r = KanbanBoardCSVRenderer(kanban_app, '%(double)s %(id2)d', out)
+    r.add_computed_columns([ 'double', 'id2' ], columns)
+    r.render(r.group_by_status())
+    assert out.getvalue().splitlines() == [ 'READY,DOING,DONE', 'aa 0,,bb 2', 'cc 4,,' ]
+    assert calls == [ [ 0, 1, 2 ] ]
+    assert r.resolve(kanban_app.kanban_store.get_item(3))['double'] == 'dd'
+    calls.clear()
+    r = KanbanBoardCSVRenderer(kanban_app, '%(double)s %(id2)d', io.StringIO())
+    r.batch_size = 1
+    r.add_computed_columns([ 'double', 'id2' ], columns)
+    r.render(r.group_by_status())
+    assert calls == [ [ 0, 1 ], [ 2 ] ]
+
+# a JSON record per item with stored and computed fields, in column order
+def test_jsonl_renderer(kanban_app):
+    import datetime, json
+    k = kanban_app.kanban_store
+    k.edit_item(0, { 'changed': datetime.datetime(2026, 3, 1, 12, 30), 'tags': [ 'x' ] })
+    out = io.StringIO()
+    r = KanbanBoardJSONLRenderer(kanban_app, None, out)
+    r.add_computed_field('upper', lambda d: d['description'].upper(), depends=['description'])
+    r.add_computed_field('tags', lambda d: ' '.join(d.get('tags', [])), depends=['tags'])
+    r.render(r.group_by_status())
+    records = [ json.loads(l) for l in out.getvalue().splitlines() ]
+    assert [ r['id'] for r in records ] == [ 0, 2, 1 ]
+    assert records[0] == { 'id': 0, 'description': 'a', 'status': 'READY', 'changed': '2026-03-01T12:30:00',
+            'tags': [ 'x' ], 'upper': 'A' }
+    out = io.StringIO()
+    r = KanbanBoardJSONLRenderer(kanban_app, [ 'id', 'tags', 'missing' ], out)
+    r.add_computed_field('tags', lambda d: ' '.join(d.get('tags', [])), depends=['tags'])
+    r.render_items(k.items())
+    assert [ json.loads(l) for l in out.getvalue().splitlines() ] == [
+        { 'id': i, 'tags': t, 'missing': None } for i, t in [ (0, 'x'), (1, ''), (2, ''), (3, '') ] ]
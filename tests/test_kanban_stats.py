@@ -0,0 +1,122 @@
+import datetime
+import json
+import pathlib
+import pytest
+from click.testing import CliRunner
+
+from clikb.cli import app
+from clikb.base_kanban_store import KanbanEventLog
+from clikb.kanban_stats import KanbanFlowStats, STATS_CACHE_FILE, STATS_HISTORY_FILE, percentiles
+
+STATUSES = [ 'READY', 'DOING', 'DONE' ]
+
+def day(n, hour=12):
+    return datetime.datetime(2026, 3, 1 + n, hour)
+
+def event(idx, status, date):
+    return { 'id': idx, 'status': status, 'date': date }
+
+@pytest.fixture
+def event_log(tmpdir):
+    log = KanbanEventLog(tmpdir)
+    log.append([
+        event(0, 'READY', day(0)), event(1, 'READY', day(0)),
+        event(0, 'DOING', day(2)), event(1, 'DONE', day(3)),
+        event(0, 'DONE', day(6)), event(2, 'READY', day(6)),
+    ], fsync=False)
+    return log
+
+def test_percentiles():
+    assert percentiles([ 4, 1, 3, 2 ], (50, 100)) == { 50: 2, 100: 4 }
+    assert percentiles([], (50,)) == { 50: None }
+
+# lead and cycle times, throughput and the number of items per status per day
+def test_report(tmpdir, event_log):
+    flow = KanbanFlowStats(tmpdir)
+    assert flow.update() == 6
+    r = flow.report(STATUSES, 'DOING', 'DONE', today=datetime.date(2026, 3, 7))
+    assert (r['items'], r['done']) == (3, 2)
+    assert r['lead_time_days'] == { 50: 3.0, 85: 6.0, 95: 6.0 }
+    assert r['cycle_time_days'] == { 50: 0.0, 85: 4.0, 95: 4.0 }
+    assert r['throughput'] == { '2026-W10': 2 }
+    assert r['cfd']['days'] == [
+        [ '2026-03-01', 2, 0, 0 ], [ '2026-03-02', 2, 0, 0 ], [ '2026-03-03', 1, 1, 0 ],
+        [ '2026-03-04', 0, 1, 1 ], [ '2026-03-05', 0, 1, 1 ], [ '2026-03-06', 0, 1, 1 ],
+        [ '2026-03-07', 1, 0, 2 ] ]
+
+# only events logged after the cached ones are read, in date order per item,
+# and only the items they are about are counted again. Without new events the
+# histories are not read.
+def test_incremental_update(tmpdir, event_log):
+    flow = KanbanFlowStats(tmpdir)
+    flow.update()
+    flow.report(STATUSES, 'DOING', 'DONE')
+    flow.save()
+    flow = KanbanFlowStats(tmpdir)
+    flow.load()
+    assert flow.update() == 0
+    assert flow.histories is None
+    event_log.append([ event(2, 'DONE', day(8)), event(2, 'DOING', day(7)) ], fsync=False)
+    assert flow.update() == 2
+    assert [ s for t, d, s in flow.histories[2] ] == [ 'READY', 'DOING', 'DONE' ]
+    r = flow.report(STATUSES, 'DOING', 'DONE', today=datetime.date(2026, 3, 9))
+    assert r['done'] == 3
+    assert r['throughput'] == { '2026-W10': 2, '2026-W11': 1 }
+    # the same as counting all items at once
+    fresh = KanbanFlowStats(tmpdir)
+    fresh.update()
+    assert fresh.report(STATUSES, 'DOING', 'DONE', today=datetime.date(2026, 3, 9)) == r
+    assert fresh.aggregates == flow.aggregates
+
+# a torn append is skipped, a line that is still being written is read later
+def test_torn_events(tmpdir, event_log):
+    with event_log.fn.open("ab") as f:
+        f.write(b'{"id": 2, "sta')
+    event_log.append([ event(2, 'DOING', day(7)) ], fsync=False)
+    with event_log.fn.open("ab") as f:
+        f.write(b'{"id": 2, "status": "DONE", "date": "2026-03-09T12:00:00"}')
+    flow = KanbanFlowStats(tmpdir)
+    assert flow.update() == 7
+    with event_log.fn.open("ab") as f:
+        f.write(b'\n')
+    assert flow.update() == 1
+    assert [ s for t, d, s in flow.histories[2] ] == [ 'READY', 'DOING', 'DONE' ]
+
+# a histories cache that does not match the totals is read again from the log
+def test_stale_histories(tmpdir, event_log):
+    flow = KanbanFlowStats(tmpdir)
+    flow.update()
+    r = flow.report(STATUSES, 'DOING', 'DONE', today=datetime.date(2026, 3, 7))
+    flow.save()
+    (pathlib.Path(tmpdir) / STATS_HISTORY_FILE).unlink()
+    flow = KanbanFlowStats(tmpdir)
+    flow.load()
+    assert flow.report(STATUSES, 'READY', 'DONE', today=datetime.date(2026, 3, 7))['items'] == 3
+    assert flow.report(STATUSES, 'DOING', 'DONE', today=datetime.date(2026, 3, 7)) == r
+
+# a stats cache that would run code is ignored
+def test_unsafe_cache(tmpdir, event_log):
+    import os, pickle
+    class Payload:
+        def __reduce__(self):
+            return (os.system, ('touch %s' % (pathlib.Path(tmpdir) / 'ran'),))
+    with (pathlib.Path(tmpdir) / STATS_CACHE_FILE).open("wb") as f:
+        pickle.dump(Payload(), f)
+    flow = KanbanFlowStats(tmpdir)
+    flow.load()
+    assert not (pathlib.Path(tmpdir) / 'ran').exists()
+    assert flow.update() == 6
+
+# stats only needs the board and the event log
+def test_stats_command(test_file, tmpdir, event_log):
+    import shutil
+    shutil.copyfile(test_file('test_store1') / 'board.kbb', pathlib.Path(tmpdir) / 'board.kbb')
+    runner = CliRunner()
+    r = runner.invoke(app, [ '-d', str(tmpdir), 'stats', '--json' ])
+    assert r.exit_code == 0
+    assert json.loads(r.output)['throughput'] == { '2026-W10': 2 }
+    assert (pathlib.Path(tmpdir) / STATS_CACHE_FILE).exists()
+    r = runner.invoke(app, [ '-d', str(tmpdir), 'stats' ])
+    assert r.output.splitlines()[0] == '3 items with history, 2 reached DONE'
+    r = runner.invoke(app, [ '-d', str(tmpdir), 'stats', '--cfd' ])
+    assert r.output.splitlines()[:2] == [ 'date,READY,DOING,DONE', '2026-03-01,2,0,0' ]
@@ -1,13 +1,10 @@
+import os
 import pathlib
 import pytest
 
+from clikb import kanban_directory_store
 from clikb.kanban_directory_store import KanbanDirectoryStore
-
-@pytest.fixture
-def test_file():
-    def get(fn):
-        return pathlib.Path(__file__).parent / 'data' / fn
-    return get
+from clikb.base_kanban_store import LOCK_FILE, EVENT_LOG_FILE, KanbanStoreConflict
 
 # empty store
 def test_empty_store():
@@ -76,7 +73,290 @@ def test_edit_item_save_load(tmpdir):
     assert k.items()[1].get('descr') == "an edited item"
     assert k.items()[1].get('id') == 1
 
+# save only writes changed items, using their ids
+def test_save_only_dirty_items(test_file, tmpdir):
+    k = KanbanDirectoryStore()
+    k.load(test_file("test_store1"))
+    path = pathlib.Path(tmpdir) / 'test_store1'
+    assert k.save(path) == 4
+    k = KanbanDirectoryStore()
+    k.load(path)
+    assert sorted(fn.name for fn in path.iterdir() if not fn.name.startswith('.')) == [ '00000.kbi', '00002.kbi', '00003.kbi', 'board.kbb' ]
+    assert k.save() == 0
+    k.edit_item(2, {'field': 13})
+    assert k.save() == 1
+    k.add_item({'descr': "a new item"})
+    k.get_board()['plugins'] = []
+    assert k.save() == 2
+    k = KanbanDirectoryStore()
+    k.load(path)
+    assert [x['id'] for x in k.items()] == [0,2,3,4]
+    assert k.get_item(2)['field'] == 13
+    assert k.get_board()['plugins'] == []
+
+# cached load reuses parsed items and notices changed files
+def test_cached_load(store_copy):
+    path = store_copy
+    k = KanbanDirectoryStore(cache=True)
+    k.load(path)
+    assert (path / '.kbcache').exists()
+    k = KanbanDirectoryStore(cache=True)
+    k.load(path)
+    assert [x['id'] for x in k.items()] == [0,2,3]
+    with (path / '00002.kbi').open("w") as f:
+        f.write("descr: changed by hand\n")
+    (path / '00003.kbi').unlink()
+    k = KanbanDirectoryStore(cache=True)
+    k.load(path)
+    assert [x['id'] for x in k.items()] == [0,2]
+    assert k.get_item(2) == {'descr': "changed by hand", 'id': 2}
+
+# a cache can only hold data, a cache that would run code is ignored
+def test_unsafe_cache(store_copy, tmpdir):
+    import datetime, os, pickle
+    class Payload:
+        def __reduce__(self):
+            return (os.system, ('touch %s' % (pathlib.Path(tmpdir) / 'ran'),))
+    path = store_copy
+    k = KanbanDirectoryStore()
+    k.load(path)
+    k.edit_item(0, { 'due': datetime.date(2026, 3, 1) })
+    k.save()
+    KanbanDirectoryStore(cache=True).load(path)
+    k = KanbanDirectoryStore(cache=True)
+    k.load(path)
+    assert k.get_item(0)['due'] == datetime.date(2026, 3, 1)
+    with (path / '.kbcache').open("wb") as f:
+        pickle.dump(Payload(), f)
+    k = KanbanDirectoryStore(cache=True)
+    k.load(path)
+    assert not (pathlib.Path(tmpdir) / 'ran').exists()
+    assert [x['id'] for x in k.items()] == [0,2,3]
+    assert [ p.name for p in path.iterdir() if p.suffix == '.tmp' ] == []
+
+# caches get the same mode as other new files
+def test_cache_file_mode(store_copy):
+    umask = os.umask(0o022)
+    try:
+        KanbanDirectoryStore(cache=True).load(store_copy)
+    finally:
+        os.umask(umask)
+    assert (store_copy / '.kbcache').stat().st_mode & 0o777 == 0o644
+
+# lazy load only parses the items that are accessed
+def test_lazy_load(store_copy):
+    path = store_copy
+    k = KanbanDirectoryStore(lazy=True)
+    k.load(path)
+    assert k.max_idx == 3
+    with (path / '00003.kbi').open("w") as f:
+        f.write("descr: changed after load\n")
+    k.edit_item(2, {'field': 13})
+    assert k.save() == 1
+    assert k.get_item(3)['descr'] == "changed after load"
+    k.add_item({'descr': "a new item"})
+    assert [x['id'] for x in k.items()] == [0,2,3,4]
+    assert k.get_item(2)['field'] == 13
+    with pytest.raises(IndexError):
+        k.get_item(1)
+
+# items() stays in id order through adds and edits, get_items looks up many ids
+def test_get_items(test_file):
+    k = KanbanDirectoryStore()
+    k.load(test_file("test_store1"))
+    assert [x['id'] for x in k.items()] == [0,2,3]
+    k.set_item(2, {'descr': "an edited item"})
+    k.add_item({'descr': "a new item"})
+    assert [x['id'] for x in k.items()] == [0,2,3,4]
+    assert k.items()[1]['descr'] == "an edited item"
+    assert [x['descr'] for x in k.get_items([4,2])] == [ "a new item", "an edited item" ]
+    with pytest.raises(IndexError):
+        k.get_items([0,1])
+
+# a parallel load gives the same items as a sequential one
+def test_parallel_load(store_copy, monkeypatch):
+    monkeypatch.setattr(kanban_directory_store, 'PARALLEL_CHUNK_SIZE', 2)
+    monkeypatch.setattr(kanban_directory_store, 'PARALLEL_MIN_FILES', 2)
+    path = store_copy
+    k = KanbanDirectoryStore()
+    k.load(path)
+    for i in range(5):
+        k.add_item({'descr': "item %d" % i})
+    k.save()
+    k = KanbanDirectoryStore()
+    k.load(path)
+    for cache in (False, True):
+        p = KanbanDirectoryStore(cache=cache, parallel_load=2)
+        p.load(path)
+        assert p._parallel_workers(8) == 2
+        assert p.items() == k.items()
+        assert p.max_idx == k.max_idx == 8
+    k.get_board()['parallel_load'] = True
+    k.save()
+    p = KanbanDirectoryStore()
+    p.load(path)
+    assert p._parallel_workers(8) == min(os.cpu_count(), 4)
+    assert p.items() == k.items()
+
+# the worker pool is only imported for parallel loads
+def test_parallel_load_lazy_import():
+    import subprocess, sys
+    code = 'import sys, clikb.cli; print("concurrent.futures" in sys.modules)'
+    r = subprocess.run([ sys.executable, '-c', code ], stdout=subprocess.PIPE, universal_newlines=True,
+            env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)), check=True)
+    assert r.stdout == 'False\n'
+
+# refresh takes over the changes of another writer and keeps the rest
+def test_refresh(store_copy):
+    path = store_copy
+    k1 = KanbanDirectoryStore()
+    k1.load(path)
+    item0 = k1.get_item(0)
+    assert k1.refresh() is False
+    assert k1.get_item(0) is item0
+    k2 = KanbanDirectoryStore()
+    k2.load(path)
+    k2.edit_item(2, {'descr': "changed"})
+    k2.add_item({'descr': "added"})
+    k2.save()
+    k2.get_board()['plugins'] = []
+    k2.save()
+    assert k1.refresh() is True
+    assert k1.get_board()['plugins'] == []
+    assert k1.get_item(0) is item0
+    assert [ x['descr'] for x in k1.items() ] == [ item0['descr'], "changed", "another item", "added" ]
+    assert k1.max_idx == 4
+    k1.edit_item(0, {'descr': "edited"})
+    assert k1.save() == 1
+
+# refresh only lists the item files again when the directory changed
+def test_refresh_unchanged_directory(store_copy, monkeypatch):
+    path = store_copy
+    old = path.stat().st_mtime - 10
+    os.utime(path, (old, old))
+    k1 = KanbanDirectoryStore(lazy=True)
+    k1.load(path)
+    listed = []
+    names = kanban_directory_store.item_file_names
+    monkeypatch.setattr(kanban_directory_store, 'item_file_names', lambda p: listed.append(p) or names(p))
+    assert k1.refresh() is False
+    assert listed == []
+    k2 = KanbanDirectoryStore()
+    k2.load(path)
+    k2.add_item({'descr': "added"})
+    k2.save()
+    listed.clear()
+    assert k1.refresh() is False
+    assert listed == [ path ]
+    assert k1.get_item(4)['descr'] == "added"
+    # changed too recently to skip the next time
+    assert k1.refresh() is False
+    assert listed == [ path, path ]
+
+# status changes are appended to the event log when saving
+def test_status_history(store_copy):
+    import datetime
+    path = store_copy
+    k = KanbanDirectoryStore()
+    k.load(path)
+    item = { 'descr': "new", 'status': 'READY' }
+    k.log_status_change(item, 'READY', datetime.datetime(2026, 1, 1))
+    k.add_item(item)
+    k.log_status_change(k.get_item(2), 'DONE', datetime.datetime(2026, 1, 2))
+    assert k.status_history() == []
+    k.save()
+    with (path / EVENT_LOG_FILE).open("a") as f:
+        f.write('{"id": 2, "sta')
+    k.log_status_change(item, 'DONE', datetime.datetime(2026, 1, 3))
+    k.save()
+    assert [ (e['id'], e['status']) for e in k.status_history() ] == [ (4, 'READY'), (2, 'DONE'), (4, 'DONE') ]
+    assert [ e['status'] for e in k.status_history(4) ] == [ 'READY', 'DONE' ]
+    assert [ e['id'] for e in k.status_history(start=datetime.datetime(2026, 1, 2), end=datetime.datetime(2026, 1, 3)) ] == [ 2 ]
+
+# event dates are read the same without datetime.fromisoformat
+def test_parse_isoformat():
+    import datetime
+    from clikb.base_kanban_store import parse_isoformat
+    tz = datetime.timezone(datetime.timedelta(hours=-5, minutes=-30))
+    for d in [ datetime.datetime(2026, 1, 2, 3, 4, 5), datetime.datetime(2026, 1, 2, 3, 4, 5, 6),
+            datetime.datetime(2026, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc),
+            datetime.datetime(2026, 1, 2, 3, 4, 5, 6, tzinfo=tz), datetime.date(2026, 1, 2) ]:
+        assert parse_isoformat(d.isoformat()) == datetime.datetime.fromisoformat(d.isoformat())
+    with pytest.raises(ValueError):
+        parse_isoformat('2026-01-02 later')
+    with pytest.raises(TypeError):
+        parse_isoformat(None)
+
+# _status_changes of items move to the event log
+def test_migrate_status_changes(store_copy):
+    import datetime
+    path = store_copy
+    k = KanbanDirectoryStore()
+    k.load(path)
+    k.edit_item(3, { '_status_changes': [ { 'status': 'READY', 'date': datetime.datetime(2026, 1, 1) },
+        { 'status': 'DONE', 'date': datetime.datetime(2026, 1, 5) } ] })
+    k.save()
+    k = KanbanDirectoryStore()
+    k.load(path)
+    assert k.migrate_status_changes() == 1
+    k.save()
+    k = KanbanDirectoryStore()
+    k.load(path)
+    assert '_status_changes' not in k.get_item(3)
+    assert [ (e['id'], e['status'], e['date'].day) for e in k.status_history() ] == [ (3, 'READY', 1), (3, 'DONE', 5) ]
+
+# a failing save leaves the old files and no temporary files behind
+def test_save_is_atomic(store_copy, monkeypatch):
+    path = store_copy
+    k = KanbanDirectoryStore()
+    k.load(path)
+    k.edit_item(0, {'descr': "edited"})
+    k.edit_item(2, {'descr': "edited"})
+    def fail(fd):
+        raise OSError("disk full")
+    monkeypatch.setattr(os, 'fsync', fail)
+    with pytest.raises(OSError):
+        k.save()
+    monkeypatch.undo()
+    assert sorted(fn.name for fn in path.iterdir() if fn.name != LOCK_FILE) == [ '00000.kbi', '00002.kbi', '00003.kbi', 'board.kbb' ]
+    k = KanbanDirectoryStore()
+    k.load(path)
+    assert k.get_item(0)['descr'] == "a small test item"
+
 # test locking
+# an item changed by another writer since loading is not overwritten
+def test_save_conflict(store_copy):
+    path = store_copy
+    k1 = KanbanDirectoryStore()
+    k1.load(path)
+    k2 = KanbanDirectoryStore()
+    k2.load(path)
+    k1.edit_item(2, {'descr': "first"})
+    k1.save()
+    k2.edit_item(2, {'descr': "second"})
+    with pytest.raises(KanbanStoreConflict):
+        k2.save()
+    k2 = KanbanDirectoryStore()
+    k2.load(path)
+    assert k2.get_item(2)['descr'] == "first"
+    k2.edit_item(3, {'descr': "second"})
+    assert k2.save() == 1
+
+# items added by two writers both get their own id
+def test_save_renumbers_added_items(store_copy):
+    path = store_copy
+    k1 = KanbanDirectoryStore()
+    k1.load(path)
+    k2 = KanbanDirectoryStore()
+    k2.load(path)
+    k1.add_item({'descr': "first"})
+    k1.save()
+    k2.add_item({'descr': "second"})
+    k2.save()
+    assert k2.max_idx == 5
+    k = KanbanDirectoryStore()
+    k.load(path)
+    assert [ (x['id'], x['descr']) for x in k.items()[3:] ] == [ (4, "first"), (5, "second") ]
 
 # test load kanban board
 def test_load_kanban_board(test_file):